@@ -1,12 +1,71 @@
+import argparse
+import asyncio
+import logging
 import os
 from src.data_analysis_assistant import DataAnalysisAssistant
 from src.agents.llm_provider import OpenAILLMProvider
+from src.agents.query_preprocessor_agent import build_relevance_messages
+from src.eval.batch_runner import BatchRunner
+from src.schemas.sql_query_model import QueryCheckResponse
 import uuid
+from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-def main():
+# Upper bound on in-flight queries; roughly the OpenAI tier's requests-per-minute / 60
+MAX_CONCURRENT_QUERIES = 8
+
+# Example queries from the problem statement
+EXAMPLE_QUERIES = [
+    "How are you doing?",
+    # "What are the average yearly therapy costs in Non-small cell lung cancer?",
+    "Which active substances were also part of the appropriate comparative therapies?",
+    # "Show me the range of yearly therapy costs by additional benefit rating",
+    # "Give me a distribution of additional benefit ratings as a pie chart",
+    # "Are there any products that received a higher benefit rating in a reassessment in the same disease area"
+]
+
+
+def run_batch_eval():
+    """Evaluate the relevance check on the example queries as one OpenAI Batch API job."""
+    runner = BatchRunner(api_key=os.getenv("OPENAI_API_KEY"), model_name="gpt-4o-mini")
+    requests = [
+        runner.build_request(f"q{i}", build_relevance_messages(query), response_schema=QueryCheckResponse)
+        for i, query in enumerate(EXAMPLE_QUERIES)
+    ]
+    results = runner.run(requests)
+
+    for i, query in enumerate(EXAMPLE_QUERIES):
+        print(f"\n{i + 1}. Query: {query}")
+        if f"q{i}" not in results:
+            print("   No result returned")
+            continue
+        check = QueryCheckResponse.model_validate_json(results[f"q{i}"])
+        print(f"   Ignore: {check.ignore}")
+        print(f"   Reason: {check.reason}")
+
+def run_batch_pipeline():
+    """Answer the example queries end to end, running each LLM step as one OpenAI Batch API job."""
+    llm_provider = OpenAILLMProvider(api_key=os.getenv("OPENAI_API_KEY"), model_name="gpt-4o", temperature=0.0)
+    assistant = DataAnalysisAssistant(project_uuid="d3c4b61c-e7be-4d19-9e7a-d31810041b45", llm_provider=llm_provider)
+    csv_files = [
+        "data/case_study_germany_sample.csv",
+        "data/case_study_germany_treatment_costs_sample.csv"
+    ]
+    assistant.load_data(csv_files, tuple(Path(file).stem for file in csv_files))
+
+    runner = BatchRunner(api_key=os.getenv("OPENAI_API_KEY"), model_name="gpt-4o")
+    results = assistant.analyze_query_batch(EXAMPLE_QUERIES, runner)
+
+    for i, (query, result) in enumerate(zip(EXAMPLE_QUERIES, results), 1):
+        print(f"\n{i}. Query: {query}")
+        print(f"   Output Response: {result.output_response_to_user}")
+    total_cost = sum(usage["cost_usd"] for usage in runner.usage.values())
+    print(f"\nEstimated batch cost: ${total_cost:.4f} over {len(runner.usage)} batches")
+
+async def main():
     """Main function demonstrating the data analysis assistant."""
     
     # Initialize the LLM provider
@@ -29,31 +88,30 @@ def main():
     ]
     
     # generate table names from the csv files
-    table_names = [file.split("/")[-1].split(".")[0] for file in csv_files]
+    table_names = tuple(Path(file).stem for file in csv_files)
     db_path = assistant.load_data(csv_files, table_names)
     
-    # Example queries from the problem statement
-    example_queries = [
-        "How are you doing?",
-        # "What are the average yearly therapy costs in Non-small cell lung cancer?",
-        "Which active substances were also part of the appropriate comparative therapies?",
-        # "Show me the range of yearly therapy costs by additional benefit rating",
-        # "Give me a distribution of additional benefit ratings as a pie chart",
-        # "Are there any products that received a higher benefit rating in a reassessment in the same disease area"
-    ]
-    
     print("\n" + "="*60)
     print("Data Analysis Assistant - Example Queries")
     print("="*60)
     
-    for i, query in enumerate(example_queries, 1):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+
+    async def run_query(query: str):
+        async with semaphore:
+            return await assistant.analyze_query_async(query, db_path)
+
+    # Run all queries concurrently so their OpenAI round-trips overlap
+    results = await asyncio.gather(*[run_query(query) for query in EXAMPLE_QUERIES])
+
+    for i, (query, result) in enumerate(zip(EXAMPLE_QUERIES, results), 1):
         print(f"\n{i}. Query: {query}")
-        result = assistant.analyze_query(query, db_path)
         if result.ignore:
             print(f"   Reason: {result.reason_for_ignoring}")
             print(f"   Suggestion: {result.suggestion_for_fixing}")
             continue
-        print(f"   Result: {result}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Full result state: %s", result)
 
         print(f"================================================")
         print(f"Query: {result.user_query}")
@@ -64,4 +122,16 @@ def main():
     print(f"\n Conversation history: {len(assistant.get_conversation_history())} queries processed")
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Run the example queries through the data analysis assistant.")
+    parser.add_argument("--mode", choices=["online", "batch", "batch-pipeline"], default="online",
+                        help="'online' runs the full pipeline; 'batch' evaluates the relevance check via the OpenAI Batch API; "
+                             "'batch-pipeline' runs the full pipeline with one Batch API job per LLM step")
+    args = parser.parse_args()
+
+    if args.mode == "batch":
+        run_batch_eval()
+    elif args.mode == "batch-pipeline":
+        run_batch_pipeline()
+    else:
+        asyncio.run(main())
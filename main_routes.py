@@ -1,16 +1,106 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+import asyncio
+import logging
+import json
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
 from fastapi.middleware.cors import CORSMiddleware
 from src.schemas.sql_agent_state import SQLQueryState
 from src.schemas.user_session_model import UserSession
 from src.agents.llm_provider import OpenAILLMProvider
+from src.agents.batch_formatter import BatchFormatter
 from src.data_analysis_assistant import DataAnalysisAssistant
+from src.agents.sql_agent import SQLAgent
+from src.data_handler.sqlite_handler import UPLOAD_DIR, SQLiteHandler, close_all_connections
+from src.cache import LRUCache
+from src.log_config import setup_logging
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of sessions whose assistant is kept in memory
+MAX_CACHED_ASSISTANTS = 1024
+
+# (assistant, lock) pairs reused across requests for the same project; the lock serializes a project's requests
+ASSISTANTS = LRUCache(maxsize=MAX_CACHED_ASSISTANTS)
+
+# Projects known to have a database, so requests skip the filesystem check; persisted across restarts
+KNOWN_SESSIONS: set[str] = set()
+SESSIONS_FILE = os.path.join(UPLOAD_DIR, ".sessions.json")
+
+def load_known_sessions() -> None:
+    """Restore the known project UUIDs saved by a previous run."""
+    try:
+        with open(SESSIONS_FILE) as f:
+            KNOWN_SESSIONS.update(json.load(f))
+    except (OSError, ValueError) as e:
+        logger.info("No known sessions restored: %s", e)
+
+def save_known_sessions() -> None:
+    """Persist the known project UUIDs for the next run."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    with open(SESSIONS_FILE, "w") as f:
+        json.dump(sorted(KNOWN_SESSIONS), f)
+
+# Threads used to stat uploaded files concurrently
+STAT_EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+def _resolve_csvs(paths_or_dir: list[str]) -> list[tuple[str, str]]:
+    """Return (path, table name) pairs for the given files, or for every CSV in a single given directory."""
+    if len(paths_or_dir) == 1 and os.path.isdir(paths_or_dir[0]):
+        with os.scandir(paths_or_dir[0]) as entries:
+            return sorted((entry.path, entry.name[:-4]) for entry in entries if entry.is_file() and entry.name.endswith(".csv"))
+    return [(path, Path(path).stem) for path in paths_or_dir]
+
+async def _check_file_sizes(file_paths: list[str]) -> None:
+    """Stat every file concurrently and reject missing or empty ones."""
+    loop = asyncio.get_running_loop()
+    sizes = await asyncio.gather(*(loop.run_in_executor(STAT_EXECUTOR, os.path.getsize, path) for path in file_paths),
+                                 return_exceptions=True)
+    for path, size in zip(file_paths, sizes):
+        if isinstance(size, OSError):
+            raise HTTPException(status_code=400, detail=f"File not found: {path}")
+        if size == 0:
+            raise HTTPException(status_code=400, detail=f"File is empty: {path}")
+
+async def warm_up(llm_provider: OpenAILLMProvider) -> None:
+    """Open the OpenAI connections with a tiny request per model, so the first user doesn't pay for it."""
+    try:
+        await asyncio.gather(llm_provider.ainvoke("ping"), llm_provider.ainvoke_mini("ping"))
+    except Exception as e:
+        logger.warning("LLM warm-up failed: %s", e)
+
 def create_app():
-    app = FastAPI()
+    # Initialize the LLM provider
+    llm_provider = OpenAILLMProvider(api_key=os.getenv("OPENAI_API_KEY"),
+                                     model_name="gpt-4o",
+                                     temperature=0.0,
+                                     verbose=True)
+    # One formatter for every session, so concurrent queries from different users share formatting calls
+    batch_formatter = BatchFormatter(llm_provider)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Log records are written by the listener's thread, never on the event loop
+        log_listener = setup_logging()
+        log_listener.start()
+        load_known_sessions()
+        # Warm up in the background so an unreachable API can't hold up startup; keep a reference so it isn't collected
+        warm_up_task = asyncio.create_task(warm_up(llm_provider))
+        try:
+            yield
+        finally:
+            warm_up_task.cancel()
+            save_known_sessions()
+            close_all_connections()
+            log_listener.stop()
+
+    app = FastAPI(lifespan=lifespan)
 
     app.add_middleware(
         CORSMiddleware,
@@ -19,12 +109,6 @@ def create_app():
         allow_methods=["*"],
         allow_headers=["*"],
     )
-
-    # Initialize the LLM provider
-    llm_provider = OpenAILLMProvider(api_key=os.getenv("OPENAI_API_KEY"),
-                                     model_name="gpt-4o",
-                                     temperature=0.0,
-                                     verbose=True)
     
     # Default sample data files
     default_csv_files = [
@@ -32,8 +116,21 @@ def create_app():
         "data/case_study_germany_treatment_costs_sample.csv"
     ]
     
-    # Default table names
-    default_table_names = [file.split("/")[-1].split(".")[0] for file in default_csv_files]
+    # Default table names, derived once at startup
+    default_table_names = tuple(Path(file).stem for file in default_csv_files)
+
+    def get_session(project_uuid: str) -> tuple[DataAnalysisAssistant, asyncio.Lock]:
+        """Return the cached assistant and request lock for a project, creating them on first use.
+
+        Both live in one cache entry, so an evicted assistant can never keep running under a new lock.
+        """
+        session = ASSISTANTS.get(project_uuid)
+        if session is None:
+            assistant = DataAnalysisAssistant(project_uuid=project_uuid, llm_provider=llm_provider,
+                                              batch_formatter=batch_formatter)
+            session = (assistant, asyncio.Lock())
+            ASSISTANTS.put(project_uuid, session)
+        return session
 
     @app.post("/create-user-session")
     async def create_user_session(username: str = "default", csv_files: list[str] = None):
@@ -41,12 +138,22 @@ def create_app():
         project_uuid = str(uuid.uuid4())
         
         # Use provided csv_files or default ones
-        files_to_load = csv_files if csv_files else default_csv_files
-        table_names = [file.split("/")[-1].split(".")[0] for file in files_to_load]
+        if csv_files:
+            resolved = _resolve_csvs(csv_files)
+            if not resolved:
+                raise HTTPException(status_code=400, detail="No CSV files found")
+            files_to_load = [path for path, _ in resolved]
+            table_names = tuple(name for _, name in resolved)
+            await _check_file_sizes(files_to_load)
+        else:
+            files_to_load = default_csv_files
+            table_names = default_table_names
         
         # Create assistant and load data
-        assistant = DataAnalysisAssistant(project_uuid=project_uuid, llm_provider=llm_provider)
-        db_path = assistant.load_data(files_to_load, table_names)
+        assistant, _ = get_session(project_uuid)
+        # Ingest in a worker thread so the event loop keeps serving other requests
+        db_path = await asyncio.to_thread(assistant.load_data, files_to_load, table_names)
+        KNOWN_SESSIONS.add(project_uuid)
         
         return {
             "project_uuid": project_uuid,
@@ -61,40 +168,50 @@ def create_app():
         
         # If no project UUID provided, create a new session
         if not project_uuid or project_uuid == "":
-            print(f"Creating new user session for default user")
+            logger.info("Creating new user session for default user")
             session_response = await create_user_session(username="default")
             project_uuid = session_response["project_uuid"]
-            print(f"Project UUID: {project_uuid}")
+            logger.info("Project UUID: %s", project_uuid)
         
-        # Create assistant instance for this project
-        assistant = DataAnalysisAssistant(project_uuid=project_uuid, llm_provider=llm_provider)
+        # Reuse the assistant for this project, so its SQL agent and history persist
+        assistant, session_lock = get_session(project_uuid)
+        async with session_lock:
+            # Load data and initialize the SQL agent on first use of this session
+            if assistant.sql_agent is None:
+                try:
+                    # Check the file even for known projects, since a session's database may have been deleted since
+                    if not await asyncio.to_thread(assistant.sqlite_handler.database_exists, project_uuid):
+                        KNOWN_SESSIONS.discard(project_uuid)
+                        logger.info("Loading default data for project %s", project_uuid)
+                        await asyncio.to_thread(assistant.load_data, default_csv_files, default_table_names)
+                    else:
+                        logger.info("Database exists for project %s, initializing SQL agent", project_uuid)
+                        db_path = assistant.sqlite_handler.db_path_for(project_uuid)
+                        await asyncio.to_thread(assistant.attach_database, db_path)
+                except Exception as e:
+                    logger.warning("Error with database, loading default data: %s", e)
+                    await asyncio.to_thread(assistant.load_data, default_csv_files, default_table_names)
+                KNOWN_SESSIONS.add(project_uuid)
         
-        # Load data and ensure SQL agent is initialized
-        try:
-            # Construct the expected database path
-            db_path = os.path.join(assistant.sqlite_handler.upload_dir, f"{project_uuid}.sqlite")
-            if not os.path.exists(db_path):
-                print(f"Loading default data for project {project_uuid}")
-                db_path = assistant.load_data(default_csv_files, default_table_names)
-            else:
-                # Database exists but SQL agent might not be initialized
-                print(f"Database exists for project {project_uuid}, initializing SQL agent")
-                # Initialize SQL agent with existing database
-                from src.agents.sql_agent import SQLAgent
-                assistant.sql_agent = SQLAgent(db_path, sqlite_handler=assistant.sqlite_handler, llm_provider=llm_provider)
-        except Exception as e:
-            print(f"Error with database, loading default data: {e}")
-            db_path = assistant.load_data(default_csv_files, default_table_names)
+        async def event_stream():
+            # Stream the answer as server-sent events: "token" chunks, then the final "result" state
+            async with session_lock:
+                async for event in assistant.analyze_query_stream(request.query, assistant.sql_agent.db_path):
+                    yield f"data: {json.dumps(event, default=str)}\n\n"
         
         # Process the query
-        response = assistant.analyze_query(request.query, db_path)
-        return response
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
 
     @app.get("/get-conversation-history")
     async def get_conversation_history(project_uuid: str):
         """Get conversation history for a specific project."""
-        assistant = DataAnalysisAssistant(project_uuid=project_uuid, llm_provider=llm_provider)
-        return assistant.get_conversation_history()
+        session = ASSISTANTS.get(project_uuid)
+        if session is not None:
+            return session[0].get_conversation_history()
+        # History is only kept in memory, so a project whose assistant isn't cached has none yet
+        if await asyncio.to_thread(SQLiteHandler.get().database_exists, project_uuid):
+            return []
+        raise HTTPException(status_code=404, detail="Unknown project")
 
     return app
 
@@ -103,4 +220,5 @@ app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Let uvicorn's loggers propagate to the queued root logger instead of configuring their own handlers
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None)
\ No newline at end of file
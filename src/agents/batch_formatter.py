@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from langchain_core.prompts import ChatPromptTemplate
+from src.agents.llm_provider import OpenAILLMProvider
+from src.schemas.sql_query_model import FormattedAnswersResponse
+
+logger = logging.getLogger(__name__)
+
+# Most requests packed into one prompt
+MAX_BATCH_SIZE = 8
+
+_BATCH_FORMAT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an AI assistant that formats database query results into human-readable responses. You are given several numbered user questions, each with its query results. For each one, give a conclusion to the user's question based on its query results. Do not give the answers in markdown format. Give each answer in one line. Return exactly one answer per question, in the same order."),
+    ("human", "{items}\n\nFormatted responses:"),
+])
+
+
+class BatchFormatter:
+    """Coalesces concurrent result-formatting requests into a single LLM call.
+
+    One instance is meant to be shared by every assistant using the same LLM provider, so requests from
+    different sessions can join the same batch.
+    """
+
+    def __init__(self, llm_provider: OpenAILLMProvider, max_batch_size: int = MAX_BATCH_SIZE):
+        self.llm_provider = llm_provider
+        self.max_batch_size = max_batch_size
+        self._answers_llm = llm_provider.with_structured_output(FormattedAnswersResponse)
+        # Pending requests per event loop, since futures can't be resolved from another loop
+        self._pending = {}
+        self._tasks = set()
+
+    async def format(self, prompt, question: str, results: str) -> str:
+        """Format one question's results, batched with any requests made in the same event loop iteration.
+
+        The batch goes out on the loop's next iteration, so a lone request isn't delayed.
+        prompt is the single-question prompt, used when no other request joins the batch.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(loop, [])
+        pending.append((prompt, question, results, future))
+        if len(pending) >= self.max_batch_size:
+            self._flush(loop)
+        elif len(pending) == 1:
+            loop.call_soon(self._flush, loop)
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Dispatch a loop's pending requests as one batch."""
+        batch = self._pending.pop(loop, None)
+        if batch:
+            task = loop.create_task(self._run(batch))
+            # Keep a reference so the task isn't garbage collected while running
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list) -> None:
+        """Format a batch and resolve each request's future with its answer."""
+        try:
+            answers = await self._format_batch(batch)
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (*_, future), answer in zip(batch, answers):
+            if not future.done():
+                future.set_result(answer)
+
+    async def _format_batch(self, batch: list) -> list[str]:
+        """Return one answer per request, asking for all of them in a single prompt when there are several."""
+        if len(batch) == 1:
+            return [await self.llm_provider.ainvoke(batch[0][0])]
+
+        items = "\n\n".join(
+            f"{i}. User question: {question}\nQuery results: {results}"
+            for i, (_, question, results, _) in enumerate(batch, 1)
+        )
+        response = await self._answers_llm.ainvoke(_BATCH_FORMAT_PROMPT.format(items=items))
+        if len(response.answers) == len(batch):
+            return response.answers
+
+        # The model didn't answer every question, so format each one on its own
+        logger.warning("Batched formatting returned %d answers for %d questions", len(response.answers), len(batch))
+        return await asyncio.gather(*(self.llm_provider.ainvoke(prompt) for prompt, *_ in batch))
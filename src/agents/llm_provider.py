@@ -1,15 +1,112 @@
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.output_parsers.openai_tools import JsonOutputKeyToolsParser
+import asyncio
+import httpx
 import os
+import threading
+from typing import Any, AsyncIterator, Callable
+
+# One connection pool shared by every model, so TLS sessions and keep-alive connections are reused
+HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+
+
+class PerLoopTransport(httpx.AsyncBaseTransport):
+    """Async transport keeping a separate connection pool per event loop.
+
+    Pooled connections are bound to the loop that opened them, and the sync API runs each call in a new loop.
+    """
+
+    def __init__(self, limits: httpx.Limits = HTTP_LIMITS):
+        self.limits = limits
+        self._transports = {}
+        self._lock = threading.Lock()
+
+    def _transport(self) -> httpx.AsyncHTTPTransport:
+        """Return the current loop's transport, dropping those of loops that have been closed."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                self._transports = {other: t for other, t in self._transports.items() if not other.is_closed()}
+                transport = httpx.AsyncHTTPTransport(limits=self.limits)
+                self._transports[loop] = transport
+            return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._transport().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+
+SHARED_HTTP_CLIENT = httpx.Client(limits=HTTP_LIMITS, timeout=60.0)
+SHARED_ASYNC_HTTP_CLIENT = httpx.AsyncClient(transport=PerLoopTransport(), timeout=60.0)
 
 class OpenAILLMProvider():
-    def __init__(self, api_key: str, model_name: str = "gpt-4o", temperature: float=0.0, verbose: bool=True):
+    def __init__(self, api_key: str, model_name: str = "gpt-4o", temperature: float=0.0, verbose: bool=True,
+                 secondary_model_name: str = "gpt-4o-mini", embedding_model_name: str = "text-embedding-3-small"):
         self.llm_model = ChatOpenAI(api_key=api_key, 
                                     model=model_name, 
                                     temperature=temperature, 
-                                    verbose=verbose)
+                                    verbose=verbose,
+                                    http_client=SHARED_HTTP_CLIENT,
+                                    http_async_client=SHARED_ASYNC_HTTP_CLIENT)
+        # Smaller model for cheap tasks such as query classification and rewriting
+        self.mini_model = ChatOpenAI(api_key=api_key,
+                                     model=secondary_model_name,
+                                     temperature=temperature,
+                                     verbose=verbose,
+                                     http_client=SHARED_HTTP_CLIENT,
+                                     http_async_client=SHARED_ASYNC_HTTP_CLIENT)
+        # Embedding model for matching near-duplicate queries
+        self.embeddings = OpenAIEmbeddings(api_key=api_key,
+                                           model=embedding_model_name,
+                                           http_client=SHARED_HTTP_CLIENT,
+                                           http_async_client=SHARED_ASYNC_HTTP_CLIENT)
+        # Structured-output runnables are rebuilt from the schema on every call, so keep one per schema
+        self._structured_cache = {}
     
     def invoke(self, prompt) -> str:
         return self.llm_model.invoke(prompt).content
+
+    async def ainvoke(self, prompt) -> str:
+        response = await self.llm_model.ainvoke(prompt)
+        return response.content
+
+    async def astream(self, prompt) -> AsyncIterator[str]:
+        async for chunk in self.llm_model.astream(prompt):
+            if chunk.content:
+                yield chunk.content
+
+    def invoke_mini(self, prompt) -> str:
+        return self.mini_model.invoke(prompt).content
+
+    async def ainvoke_mini(self, prompt) -> str:
+        response = await self.mini_model.ainvoke(prompt)
+        return response.content
     
     def with_structured_output(self, schema):
-        return self.llm_model.with_structured_output(schema)
+        return self._structured_output(self.llm_model, schema)
+
+    def with_structured_output_mini(self, schema):
+        return self._structured_output(self.mini_model, schema)
+
+    def _structured_output(self, model: ChatOpenAI, schema):
+        key = (model.model_name, schema)
+        if key not in self._structured_cache:
+            self._structured_cache[key] = model.with_structured_output(schema)
+        return self._structured_cache[key]
+
+    def with_structured_output_precomputed(self, name: str, schema_dict: dict, parser: Callable[[dict], Any], mini: bool = False):
+        """Structured output from a precomputed JSON schema, forcing a single tool call that parser turns into the result."""
+        model = self.mini_model if mini else self.llm_model
+        key = (model.model_name, name)
+        if key not in self._structured_cache:
+            tool = {"type": "function", "function": {"name": name, "parameters": schema_dict}}
+            bound = model.bind_tools([tool], tool_choice=name)
+            self._structured_cache[key] = bound | JsonOutputKeyToolsParser(key_name=name, first_tool_only=True) | parser
+        return self._structured_cache[key]
@@ -1,11 +1,25 @@
 import os
+import re
+from typing import Iterable, Optional
+from langchain_core.messages import HumanMessage, SystemMessage
 from src.agents.llm_provider import OpenAILLMProvider
-from src.schemas.sql_query_model import QueryCheckResponse
+from src.cache import LRUCache
+from src.schemas.sql_query_model import QueryCheckResponse, QueryTriageResponse, QUERY_CHECK_SCHEMA, QUERY_TRIAGE_SCHEMA
 
-def check_if_query_is_related_to_data(user_query: str, llm_provider: OpenAILLMProvider) -> QueryCheckResponse:
-    prompt = f"""You are a data analysis assistant. Check if the user's query is about data analysis, statistics, or insights from CSV data.
+# Cheap keyword pre-filter so obvious queries skip the LLM relevance check
+ACCEPT_RE = re.compile(r"\b(average|mean|distribution|charts?|pie|bar|scatter|group by|therap(?:y|ies)|costs?|benefits?|substances?|filter|correlat\w*|trends?)\b", re.I)
+REJECT_RE = re.compile(r"\b(weather|jokes?|how are you|your name|who are you)\b", re.I)
 
-ACCEPT queries about:
+# LLM answers are deterministic for a query (temperature 0), so repeated queries reuse them
+QUERY_CACHE_SIZE = 4096
+_query_cache = LRUCache(maxsize=QUERY_CACHE_SIZE)
+
+# Table and column names shorter than this are too generic to count as data terms
+MIN_DATA_TERM_LENGTH = 4
+
+# System prompts are module constants, sent as a separate system message ahead of the user query,
+# so every request starts with an identical prefix that OpenAI can serve from its prompt cache
+_RELEVANCE_CRITERIA = """ACCEPT queries about:
 - Data analysis, statistics, trends, patterns, averages, ranges, distributions
 - Charts, graphs, visualizations, pie charts, bar charts, scatter plots
 - Data filtering, grouping, aggregations, comparisons, correlations
@@ -24,27 +38,122 @@ REJECT queries about:
 - Technical support unrelated to data
 - Questions that don't involve analyzing data
 
-IMPORTANT: All questions about medical data, therapy costs, drug analysis, benefit ratings, and pharmaceutical information should be ACCEPTED as they are data analysis queries.
+IMPORTANT: All questions about medical data, therapy costs, drug analysis, benefit ratings, and pharmaceutical information should be ACCEPTED as they are data analysis queries."""
 
-User query: {user_query}"""
-    
-    response = llm_provider.with_structured_output(QueryCheckResponse)
-    response = response.invoke(prompt)
-    return response
+_PREPROCESS_TASKS = """- Clarify ambiguous data analysis requests
+- Extract specific metrics, filters, or comparisons needed
+- Identify the type of analysis (statistical, visual, export)
+- Preserve context from previous questions if referenced"""
 
+_RELEVANCE_SYSTEM_PROMPT = f"""You are a data analysis assistant. Check if the user's query is about data analysis, statistics, or insights from CSV data.
 
-def preprocess_query(user_query: str, llm_provider: OpenAILLMProvider) -> str:
-    prompt = f"""You are a data analysis assistant. Preprocess the user's query to be clear and actionable for data analysis.
+{_RELEVANCE_CRITERIA}"""
+
+_PREPROCESS_SYSTEM_PROMPT = f"""You are a data analysis assistant. Preprocess the user's query to be clear and actionable for data analysis.
 
 Tasks:
-- Clarify ambiguous data analysis requests
-- Extract specific metrics, filters, or comparisons needed
-- Identify the type of analysis (statistical, visual, export)
-- Preserve context from previous questions if referenced
+{_PREPROCESS_TASKS}
+
+Return a clear, specific query ready for data analysis."""
+
+_TRIAGE_SYSTEM_PROMPT = f"""You are a data analysis assistant. Complete both tasks below and return the results together.
+
+--- TASK 1: RELEVANCE CHECK ---
+Check if the user's query is about data analysis, statistics, or insights from CSV data.
+
+{_RELEVANCE_CRITERIA}
+
+Set "ignore" to true for rejected queries, explain the decision in "reason" and, for rejected queries, give a short "suggestion" on how to rephrase it as a data question.
+
+--- TASK 2: PREPROCESS ---
+If the query is accepted, preprocess it to be clear and actionable for data analysis:
+{_PREPROCESS_TASKS}
+
+Return the clear, specific query ready for data analysis in "preprocessed_query". Leave it empty if the query is rejected."""
+
+
+def _build_messages(system_prompt: str, user_query: str) -> list:
+    """Build the chat messages for a static system prompt and the user's query."""
+    return [SystemMessage(content=system_prompt), HumanMessage(content=f"User query: {user_query}")]
+
 
-User query: {user_query}
+def build_relevance_messages(user_query: str) -> list:
+    """Build the relevance-check messages, e.g. for submitting through the Batch API."""
+    return _build_messages(_RELEVANCE_SYSTEM_PROMPT, user_query)
 
-Return a clear, specific query ready for data analysis:"""
-    
-    response = llm_provider.invoke(prompt)
-    return response
\ No newline at end of file
+
+def build_data_terms_re(names: Iterable[str]) -> Optional[re.Pattern]:
+    """Compile a pattern matching table/column names, accepting spaces in place of underscores."""
+    terms = sorted({name.lower() for name in names if len(name) >= MIN_DATA_TERM_LENGTH}, key=len, reverse=True)
+    if not terms:
+        return None
+    alternatives = "|".join(re.escape(term).replace("_", "[ _]") for term in terms)
+    return re.compile(rf"\b({alternatives})\b", re.I)
+
+
+def prefilter_query(user_query: str, data_terms_re: Optional[re.Pattern] = None) -> Optional[bool]:
+    """Return True to accept, False to reject, or None when the LLM has to decide."""
+    accepted = bool(ACCEPT_RE.search(user_query)) or bool(data_terms_re and data_terms_re.search(user_query))
+    rejected = bool(REJECT_RE.search(user_query))
+    if accepted and not rejected:
+        return True
+    if rejected and not accepted:
+        return False
+    return None
+
+
+async def check_if_query_is_related_to_data(user_query: str, llm_provider: OpenAILLMProvider,
+                                            data_terms_re: Optional[re.Pattern] = None) -> QueryCheckResponse:
+    decision = prefilter_query(user_query, data_terms_re)
+    if decision is True:
+        return QueryCheckResponse(ignore=False, reason="The query mentions data analysis terms.")
+    if decision is False:
+        return QueryCheckResponse(ignore=True, reason="The query is not about data analysis.")
+
+    cache_key = ("check", id(llm_provider), user_query)
+    cached = _query_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = build_relevance_messages(user_query)
+    response = llm_provider.with_structured_output_precomputed("QueryCheckResponse", QUERY_CHECK_SCHEMA,
+                                                               QueryCheckResponse.model_validate, mini=True)
+    response = await response.ainvoke(prompt)
+    _query_cache.put(cache_key, response)
+    return response
+
+
+async def preprocess_query(user_query: str, llm_provider: OpenAILLMProvider) -> str:
+    cache_key = ("preprocess", id(llm_provider), user_query)
+    cached = _query_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = _build_messages(_PREPROCESS_SYSTEM_PROMPT, user_query)
+    response = await llm_provider.ainvoke_mini(prompt)
+    _query_cache.put(cache_key, response)
+    return response
+
+
+async def triage_and_preprocess(user_query: str, llm_provider: OpenAILLMProvider,
+                                data_terms_re: Optional[re.Pattern] = None) -> QueryTriageResponse:
+    """Check relevance and preprocess the query in a single LLM call."""
+    decision = prefilter_query(user_query, data_terms_re)
+    if decision is False:
+        return QueryTriageResponse(ignore=True, reason="The query is not about data analysis.", suggestion="", preprocessed_query=None)
+    if decision is True:
+        preprocessed_query = await preprocess_query(user_query=user_query, llm_provider=llm_provider)
+        return QueryTriageResponse(ignore=False, reason="The query mentions data analysis terms.", suggestion="", preprocessed_query=preprocessed_query)
+
+    cache_key = ("triage", id(llm_provider), user_query)
+    cached = _query_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = _build_messages(_TRIAGE_SYSTEM_PROMPT, user_query)
+
+    response = llm_provider.with_structured_output_precomputed("QueryTriageResponse", QUERY_TRIAGE_SCHEMA,
+                                                               QueryTriageResponse.model_validate, mini=True)
+    response = await response.ainvoke(prompt)
+    _query_cache.put(cache_key, response)
+    return response
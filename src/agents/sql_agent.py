@@ -1,31 +1,36 @@
+import asyncio
+import copy
+import hashlib
+from functools import cached_property
 import os
+from typing import AsyncIterator, Sequence
 from src.agents.llm_provider import OpenAILLMProvider
+from src.agents.batch_formatter import BatchFormatter
+from src.cache import LRUCache
 from langchain_core.prompts import ChatPromptTemplate
-from src.data_handler.sqlite_handler import get_schema, SQLiteHandler
-from src.schemas.sql_query_model import QueryParseResponse, VisualizationTypeResponse
+from src.data_handler.sqlite_handler import get_schema_blocks, join_schema_blocks, SQLiteHandler, NOUN_INDEX_TABLE
+from src.schemas.sql_query_model import QueryParseResponse, SQLPlanResponse, VisualizationTypeResponse
 from src.schemas.sql_agent_state import SQLQueryState
 
 from src.vis.data_formatter import DataFormatter
 
-class SQLAgent:
-    def __init__(self, db_path: str, sqlite_handler: SQLiteHandler = None, llm_provider: OpenAILLMProvider = None):
-        self.sqlite_handler = sqlite_handler
-        self.llm_provider = llm_provider
-        self.db_path = db_path
-        self.sql_query_state = SQLQueryState()
-        self.data_formatter = DataFormatter(llm_provider=self.llm_provider)
+# Chart types the SQL generation step may suggest, so the separate visualization call can be skipped
+VISUALIZATION_TYPES = {"bar", "horizontal_bar", "line", "pie", "scatter", "none"}
 
+# Result rows shown to the LLM when formatting the answer or choosing a chart; the rest are summarized by a count
+MAX_PROMPT_ROWS = 20
 
-    def parse_question(self, question: str) -> QueryParseResponse:
-        """Parse user question and identify relevant tables and columns."""
-        
-        self.sql_query_state.user_query = question
+# Most frequent distinct values passed to SQL generation, to keep the prompt short on high-cardinality columns
+MAX_UNIQUE_NOUNS = 500
 
-        # Get the database schema
-        schema = get_schema(self.db_path)
+# Parses and SQL plans are deterministic for a schema and question (temperature 0), so recurring questions reuse them
+PLAN_CACHE_SIZE = 1024
+_parse_cache = LRUCache(maxsize=PLAN_CACHE_SIZE)
+_plan_cache = LRUCache(maxsize=PLAN_CACHE_SIZE)
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", '''You are a data analyst that can help summarize SQL tables and parse user questions about a database. 
+# Prompt templates are static, so they are built once at import
+_PARSE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", '''You are a data analyst that can help summarize SQL tables and parse user questions about a database. 
         Given the question and database schema, identify the relevant tables and columns. 
         If the question is not relevant to the database or if there is not enough information to answer the question, set is_relevant to false and return an empty "relevant_tables" array.
 
@@ -45,51 +50,14 @@ class SQLAgent:
 
         The "noun_columns" field should contain only the columns that are relevant to the question and contain nouns or names. For example, the column "brand_name" contains nouns relevant to the question "What are the top selling brands?", but the column "assessment_number" is not relevant because it does not contain a noun. Do not include columns that contain only numbers.
         '''),
-            ("human", "===Database schema:\n{schema}\n\n===User question:\n{question}\n\nIdentify relevant tables and columns:")
-        ])
-
-        # Format the prompt with the schema and question
-        formatted_prompt = prompt.format(schema=schema, question=question)
-        
-        # Get structured output
-        response = self.llm_provider.with_structured_output(QueryParseResponse)
-        result = response.invoke(formatted_prompt)
-        self.sql_query_state.query_parse_response = result
-        return result
-
-    def get_unique_nouns(self) -> dict:
-        """Find unique nouns in relevant tables and columns."""
-
-        if not self.sql_query_state.query_parse_response.is_relevant:
-            return {"unique_nouns": []}
-
-        unique_nouns = set()
-        for table_info in self.sql_query_state.query_parse_response.relevant_tables:
-            table_name = table_info.table_name
-            noun_columns = table_info.noun_columns
-            
-            if noun_columns:
-                column_names = ', '.join(f"`{col}`" for col in noun_columns)
-                query = f"SELECT DISTINCT {column_names} FROM `{table_name}`"
-                results = self.sqlite_handler.execute_query(self.db_path, query)
-                for row in results:
-                    unique_nouns.update(str(value) for value in row if value)
-
-        return {"unique_nouns": list(unique_nouns)}
-
-    def generate_sql(self) -> dict:
-        """Generate SQL query based on parsed question and unique nouns."""
+    ("human", "===Database schema:\n{schema}\n\n===User question:\n{question}\n\nIdentify relevant tables and columns:")
+])
 
-        question = self.sql_query_state.user_query
-        parsed_question = self.sql_query_state.query_parse_response
-        unique_nouns = self.sql_query_state.unique_nouns
-        schema = get_schema(self.db_path)
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", '''
+_GENERATE_SQL_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", '''
 You are an AI assistant that generates SQL queries based on user questions, database schema, and unique nouns found in the relevant tables. Generate a valid SQL query to answer the user's question.
 
-If there is not enough information to write a SQL query, respond with "NOT_ENOUGH_INFO".
+If there is not enough information to write a SQL query, set "sql_query" to null and briefly explain what is missing in "not_enough_info_reason". Otherwise set "not_enough_info_reason" to null.
 
 Here are some examples:
 
@@ -115,9 +83,13 @@ count the frequency of each additional benefit rating per disease area.
 The x-axis should represent the category (e.g., additional_benefit), and the y-axis should represent the count.
 
 SKIP ALL ROWS WHERE ANY COLUMN IS NULL or "N/A" or "".
-Just give the query string. Do not format it. Make sure to use the correct spellings of nouns as provided in the unique nouns list. All the table and column names should be enclosed in backticks.
+Give the plain query string in "sql_query". Do not format it. Make sure to use the correct spellings of nouns as provided in the unique nouns list. All the table and column names should be enclosed in backticks.
+
+Also set "visualization_hint" to the chart that best fits the query's result, using ONLY one of these names: bar, horizontal_bar, line, pie, scatter, none.
+Use pie for proportions of a whole, line or scatter only when the x axis is continuous or time based, bar for comparing categories, and none when a chart adds nothing (e.g. a single value).
+If you are not sure, leave "visualization_hint" empty.
 '''),
-            ("human", '''===Database schema:
+    ("human", '''===Database schema:
 {schema}
 
 ===User question:
@@ -130,20 +102,212 @@ Just give the query string. Do not format it. Make sure to use the correct spell
 {unique_nouns}
 
 Generate SQL query string'''),
-        ])
+])
+
+_FORMAT_RESULTS_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an AI assistant that formats database query results into a human-readable response. Give a conclusion to the user's question based on the query results. Do not give the answer in markdown format. Only give the answer in one line."),
+    ("human", "User question: {question}\n\nQuery results: {results}\n\nFormatted response:"),
+])
+
+_VISUALIZATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", '''
+You are an AI assistant that recommends appropriate data visualizations. Based on the user's question, SQL query, and query results, suggest the most suitable type of graph or chart to visualize the data. If no visualization is appropriate, indicate that.
+
+Available chart types and their use cases:
+- Bar Graphs: Best for comparing categorical data or showing changes over time when categories are discrete and the number of categories is more than 2. Use for questions like "What are the sales figures for each product?" or "How does the population of cities compare? or "What percentage of each city is male?"
+- Horizontal Bar Graphs: Best for comparing categorical data or showing changes over time when the number of categories is small or the disparity between categories is large. Use for questions like "Show the revenue of A and B?" or "How does the population of 2 cities compare?" or "How many men and women got promoted?" or "What percentage of men and what percentage of women got promoted?" when the disparity between categories is large.
+- Scatter Plots: Useful for identifying relationships or correlations between two numerical variables or plotting distributions of data. Best used when both x axis and y axis are continuous. Use for questions like "Plot a distribution of the fares (where the x axis is the fare and the y axis is the count of people who paid that fare)" or "Is there a relationship between advertising spend and sales?" or "How do height and weight correlate in the dataset? Do not use it for questions that do not have a continuous x axis."
+- Pie Charts: Ideal for showing proportions or percentages within a whole. Use for questions like "What is the market share distribution among different companies?" or "What percentage of the total revenue comes from each product?"
+- Line Graphs: Best for showing trends and distributionsover time. Best used when both x axis and y axis are continuous. Used for questions like "How have website visits changed over the year?" or "What is the trend in temperature over the past decade?". Do not use it for questions that do not have a continuous x axis or a time based x axis.
+
+Consider these types of questions when recommending a visualization:
+1. Aggregations and Summarizations (e.g., "What is the average yearly therapy costs in Non-small cell lung cancer?" - Bar Graph)
+2. Comparisons (e.g., "Which active substances were also part of the appropriate comparative therapies?" - Bar Graph)
+3. Plotting Distributions (e.g., "Show me the range of yearly therapy costs by additional benefit rating." - Bar Graph)
+4. Trends Over Time (e.g., "Give me a distribution of additional benefit ratings as a pie chart." - Pie Chart)
+
+Provide your response in the following format:
+Recommended Visualization: [Chart type or "None"]. ONLY use the following names: bar, horizontal_bar, line, pie, scatter, none
+'''),
+    ("human", '''
+User question: {question}
+SQL query: {sql_query}
+Query results: {results}
+
+Recommend a visualization:'''),
+])
+
+def preview_results(results: list, max_rows: int = MAX_PROMPT_ROWS) -> str:
+    """Render the first rows of the results for a prompt, noting how many rows were left out."""
+    if len(results) <= max_rows:
+        return str(results)
+    return f"{results[:max_rows]} (first {max_rows} of {len(results)} rows)"
+
+
+def scalar_answer(results: list, columns: Sequence[str]) -> str:
+    """Phrase a single-row result of at most two values, labelled by its result columns, or return None when the LLM is needed."""
+    if not isinstance(results, list) or len(results) != 1 or not 1 <= len(results[0]) <= 2:
+        return None
+    row = results[0]
+    if len(columns) != len(row) or any(value is None for value in row):
+        return None
+    answer = ", ".join(f"{column.replace('_', ' ')}: {value}" for column, value in zip(columns, row))
+    return answer[:1].upper() + answer[1:]
+
+
+def has_chartable_shape(results: list) -> bool:
+    """Check whether query results have more than one row and at least one numeric value."""
+    if len(results) <= 1:
+        return False
+    return any(isinstance(value, (int, float)) and not isinstance(value, bool) for row in results for value in row)
+
+class SQLAgent:
+    def __init__(self, db_path: str, sqlite_handler: SQLiteHandler = None, llm_provider: OpenAILLMProvider = None):
+        self.sqlite_handler = sqlite_handler
+        self.llm_provider = llm_provider
+        self.db_path = db_path
+        self.sql_query_state = SQLQueryState()
+        self._schema = None
+        self._schema_key = None
+        # Structured-output runnables and prompt pipelines are built once per agent rather than on every call
+        self._parse_chain = _PARSE_PROMPT | self.llm_provider.with_structured_output(QueryParseResponse) if llm_provider else None
+        self._plan_chain = _GENERATE_SQL_PROMPT | self.llm_provider.with_structured_output(SQLPlanResponse) if llm_provider else None
+        self._visualization_llm = self.llm_provider.with_structured_output(VisualizationTypeResponse) if llm_provider else None
+        # Read the tables first, so a missing database raises here rather than on the first query
+        table_info = sqlite_handler.get_table_info(db_path) if sqlite_handler else {}
+        self.table_info = table_info
+        # Databases loaded before the noun index existed fall back to scanning the data tables
+        self.has_noun_index = sqlite_handler.has_noun_index(db_path) if sqlite_handler else False
+        # Backtick-quoted table and column names, built once rather than on every query
+        self._quoted_tables = {table: f"`{table}`" for table in table_info}
+        self._quoted_cols = {table: {column: f"`{column}`" for column in columns} for table, columns in table_info.items()}
+
+    @cached_property
+    def data_formatter(self) -> DataFormatter:
+        """The visualization data formatter, created on first use."""
+        return DataFormatter(llm_provider=self.llm_provider)
+
+    def fork(self) -> "SQLAgent":
+        """Return a copy of this agent with a fresh query state, so concurrent queries don't share state."""
+        agent = copy.copy(self)
+        agent.sql_query_state = SQLQueryState()
+        agent._schema = None
+        agent._schema_key = None
+        return agent
+
+    def get_schema(self, tables: Sequence[str] = None) -> str:
+        """Return the database schema, optionally limited to the given tables; fetched once per query."""
+        if self._schema is None:
+            self._schema = get_schema_blocks(self.db_path)
+        return join_schema_blocks(self._schema, tables)
+
+    async def parse_question(self, question: str) -> QueryParseResponse:
+        """Parse user question and identify relevant tables and columns."""
+        # Building the schema reads the database, so keep it off the event loop
+        inputs = await asyncio.to_thread(self._parse_question_inputs, question)
+        cache_key = self._cache_key(question.strip().lower())
+        result = _parse_cache.get(cache_key)
+        if result is None:
+            # Get structured output
+            result = await self._parse_chain.ainvoke(inputs)
+            _parse_cache.put(cache_key, result)
+        self.sql_query_state.query_parse_response = result
+        return result
+
+    def _cache_key(self, *parts) -> tuple:
+        """Key a cached LLM response to the model and the rendered schema, so databases with equal schemas share entries."""
+        if self._schema_key is None:
+            schema_hash = hashlib.sha256(self.get_schema().encode()).hexdigest()
+            self._schema_key = (self.llm_provider.llm_model.model_name, schema_hash)
+        return (*self._schema_key, *parts)
+
+    def parse_question_prompt(self, question: str) -> list:
+        """Build the prompt messages for parsing the question."""
+        return _PARSE_PROMPT.format_messages(**self._parse_question_inputs(question))
+
+    def _parse_question_inputs(self, question: str) -> dict:
+        """Collect the values of the parse prompt's placeholders."""
+        self.sql_query_state.user_query = question
+
+        # Get the database schema
+        return {"schema": self.get_schema(), "question": question}
+
+    def get_unique_nouns(self) -> dict:
+        """Find unique nouns in relevant tables and columns."""
+
+        if not self.sql_query_state.query_parse_response.is_relevant:
+            return {"unique_nouns": []}
 
-        formatted_prompt = prompt.format(schema=schema, question=question, parsed_question=parsed_question, unique_nouns=unique_nouns)
-        response = self.llm_provider.invoke(formatted_prompt)
+        noun_columns = [
+            (table_info.table_name, column)
+            for table_info in self.sql_query_state.query_parse_response.relevant_tables
+            for column in table_info.noun_columns
+        ]
+        if not noun_columns:
+            return {"unique_nouns": []}
+
+        if self.has_noun_index:
+            # Read the values precomputed at load time instead of scanning the tables
+            pairs = ", ".join("(?, ?)" for _ in noun_columns)
+            query = (f"SELECT value FROM `{NOUN_INDEX_TABLE}` WHERE (table_name, column_name) IN (VALUES {pairs}) "
+                     "GROUP BY value ORDER BY SUM(frequency) DESC LIMIT ?")
+            params = [name for pair in noun_columns for name in pair] + [MAX_UNIQUE_NOUNS]
+            unique_nouns = self.sqlite_handler.execute_column_query(self.db_path, query, params)
+        else:
+            # One query over every noun column, letting SQLite do the de-duplication
+            selects = [f"SELECT CAST({self._quote_column(table_name, column)} AS TEXT) AS v FROM {self._quote_table(table_name)}"
+                       for table_name, column in noun_columns]
+            query = (f"SELECT v FROM ({' UNION ALL '.join(selects)}) WHERE v IS NOT NULL AND v != '' "
+                     "GROUP BY v ORDER BY COUNT(*) DESC LIMIT ?")
+            unique_nouns = self.sqlite_handler.execute_column_query(self.db_path, query, (MAX_UNIQUE_NOUNS,))
+        self.sql_query_state.unique_nouns = unique_nouns
+        return {"unique_nouns": unique_nouns}
+
+    def _quote_table(self, table_name: str) -> str:
+        """Return the backtick-quoted table name, quoting names not seen at load time on the fly."""
+        return self._quoted_tables.get(table_name) or f"`{table_name}`"
+
+    def _quote_column(self, table_name: str, column: str) -> str:
+        """Return the backtick-quoted column name, quoting names not seen at load time on the fly."""
+        return self._quoted_cols.get(table_name, {}).get(column) or f"`{column}`"
+
+    async def generate_sql(self) -> dict:
+        """Generate SQL query based on parsed question and unique nouns."""
+        question = self.sql_query_state.user_query
+        cache_key = self._cache_key(question.strip().lower(), tuple(self.sql_query_state.unique_nouns))
+        plan = _plan_cache.get(cache_key)
+        if plan is None:
+            plan = await self._plan_chain.ainvoke(self._generate_sql_inputs())
+            _plan_cache.put(cache_key, plan)
+        return self.apply_sql_plan(plan)
+
+    def generate_sql_prompt(self) -> list:
+        """Build the prompt messages for generating the SQL query."""
+        return _GENERATE_SQL_PROMPT.format_messages(**self._generate_sql_inputs())
+
+    def _generate_sql_inputs(self) -> dict:
+        """Collect the values of the SQL generation prompt's placeholders."""
+        question = self.sql_query_state.user_query
+        parsed_question = self.sql_query_state.query_parse_response
+        unique_nouns = self.sql_query_state.unique_nouns
+        # Only the tables picked while parsing the question are needed to write the query
+        schema = self.get_schema([table.table_name for table in parsed_question.relevant_tables])
+
+        return {"schema": schema, "question": question, "parsed_question": parsed_question, "unique_nouns": unique_nouns}
+
+    def apply_sql_plan(self, plan: SQLPlanResponse) -> SQLQueryState:
+        """Store the generated SQL query and visualization hint on the state."""
+        self.sql_query_state.visualization_hint = plan.visualization_hint.strip().lower()
         
-        if response.strip() == "NOT_ENOUGH_INFO":
+        if not plan.sql_query:
             self.sql_query_state.ignore = True
-            self.sql_query_state.reason_for_ignoring = "There is not enough information to write a SQL query"
+            self.sql_query_state.reason_for_ignoring = plan.not_enough_info_reason or "There is not enough information to write a SQL query"
             self.sql_query_state.suggestion_for_fixing = "Please provide more information to generate a SQL query."
             self.sql_query_state.generated_sql_query = "NOT_RELEVANT"
             return self.sql_query_state
         else:
             self.sql_query_state.ignore = False
-            self.sql_query_state.generated_sql_query = response
+            self.sql_query_state.generated_sql_query = plan.sql_query
             return self.sql_query_state
 
 
@@ -163,11 +327,39 @@ Generate SQL query string'''),
             return self.sql_query_state
         else:
             self.sql_query_state.ignore = False
-            self.sql_query_state.results = self.sqlite_handler.execute_query(self.db_path, query)
+            results, columns = self.sqlite_handler.execute_query_with_columns(self.db_path, query)
+            self.sql_query_state.results = results
+            self.sql_query_state.result_columns = columns
             return self.sql_query_state
 
-    def format_results(self) -> dict:
-        """Format query results into a human-readable response."""
+    async def format_results(self, batch_formatter: BatchFormatter = None) -> dict:
+        """Format query results into a human-readable response, optionally batched with concurrent queries."""
+        formatted_prompt = self.format_results_prompt()
+        if formatted_prompt is None:
+            return self.sql_query_state
+
+        if batch_formatter is not None:
+            response = await batch_formatter.format(formatted_prompt, self.sql_query_state.user_query, preview_results(self.sql_query_state.results))
+        else:
+            response = await self.llm_provider.ainvoke(formatted_prompt)
+        self.sql_query_state.output_response_to_user = response
+        return self.sql_query_state
+
+    async def astream_format_results(self) -> AsyncIterator[str]:
+        """Stream the human-readable response, storing the full text on the state once done."""
+        formatted_prompt = self.format_results_prompt()
+        if formatted_prompt is None:
+            yield self.sql_query_state.output_response_to_user
+            return
+
+        chunks = []
+        async for chunk in self.llm_provider.astream(formatted_prompt):
+            chunks.append(chunk)
+            yield chunk
+        self.sql_query_state.output_response_to_user = "".join(chunks)
+
+    def format_results_prompt(self):
+        """Build the prompt for formatting the results, or return None if the response is already set."""
         question = self.sql_query_state.user_query
         results = self.sql_query_state.results
         if results == "NOT_RELEVANT":
@@ -175,19 +367,17 @@ Generate SQL query string'''),
             self.sql_query_state.reason_for_ignoring = "There is not enough information to answer the question"
             self.sql_query_state.suggestion_for_fixing = "Please provide more information to answer the question."
             self.sql_query_state.output_response_to_user = "Sorry, not enough information to answer the question."
-            return self.sql_query_state
+            return None
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are an AI assistant that formats database query results into a human-readable response. Give a conclusion to the user's question based on the query results. Do not give the answer in markdown format. Only give the answer in one line."),
-            ("human", "User question: {question}\n\nQuery results: {results}\n\nFormatted response:"),
-        ])
+        # A single value (e.g. an aggregate) doesn't need an LLM to be put into words
+        answer = scalar_answer(results, self.sql_query_state.result_columns)
+        if answer is not None:
+            self.sql_query_state.output_response_to_user = answer
+            return None
 
-        formatted_prompt = prompt.format(question=question, results=results)
-        response = self.llm_provider.invoke(formatted_prompt)
-        self.sql_query_state.output_response_to_user = response
-        return self.sql_query_state
+        return _FORMAT_RESULTS_PROMPT.format_messages(question=question, results=preview_results(results))
 
-    def choose_visualization_type(self) -> dict:
+    async def choose_visualization_type(self) -> dict:
         """Choose the visualization type based on the user's question and query results."""
         question = self.sql_query_state.user_query
         results = self.sql_query_state.results
@@ -195,42 +385,29 @@ Generate SQL query string'''),
         if results == "NOT_RELEVANT":
             return {"visualization": "none", "visualization_reasoning": "No visualization needed for irrelevant questions."}
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", '''
-You are an AI assistant that recommends appropriate data visualizations. Based on the user's question, SQL query, and query results, suggest the most suitable type of graph or chart to visualize the data. If no visualization is appropriate, indicate that.
-
-Available chart types and their use cases:
-- Bar Graphs: Best for comparing categorical data or showing changes over time when categories are discrete and the number of categories is more than 2. Use for questions like "What are the sales figures for each product?" or "How does the population of cities compare? or "What percentage of each city is male?"
-- Horizontal Bar Graphs: Best for comparing categorical data or showing changes over time when the number of categories is small or the disparity between categories is large. Use for questions like "Show the revenue of A and B?" or "How does the population of 2 cities compare?" or "How many men and women got promoted?" or "What percentage of men and what percentage of women got promoted?" when the disparity between categories is large.
-- Scatter Plots: Useful for identifying relationships or correlations between two numerical variables or plotting distributions of data. Best used when both x axis and y axis are continuous. Use for questions like "Plot a distribution of the fares (where the x axis is the fare and the y axis is the count of people who paid that fare)" or "Is there a relationship between advertising spend and sales?" or "How do height and weight correlate in the dataset? Do not use it for questions that do not have a continuous x axis."
-- Pie Charts: Ideal for showing proportions or percentages within a whole. Use for questions like "What is the market share distribution among different companies?" or "What percentage of the total revenue comes from each product?"
-- Line Graphs: Best for showing trends and distributionsover time. Best used when both x axis and y axis are continuous. Used for questions like "How have website visits changed over the year?" or "What is the trend in temperature over the past decade?". Do not use it for questions that do not have a continuous x axis or a time based x axis.
-
-Consider these types of questions when recommending a visualization:
-1. Aggregations and Summarizations (e.g., "What is the average yearly therapy costs in Non-small cell lung cancer?" - Bar Graph)
-2. Comparisons (e.g., "Which active substances were also part of the appropriate comparative therapies?" - Bar Graph)
-3. Plotting Distributions (e.g., "Show me the range of yearly therapy costs by additional benefit rating." - Bar Graph)
-4. Trends Over Time (e.g., "Give me a distribution of additional benefit ratings as a pie chart." - Pie Chart)
+        # A single row or purely textual results can't be charted, so there is nothing to ask the LLM
+        if not has_chartable_shape(results):
+            result = VisualizationTypeResponse(visualization="none", visualization_reasoning="Result too small or not numeric to visualize.")
+            return await self._apply_visualization_type(result)
 
-Provide your response in the following format:
-Recommended Visualization: [Chart type or "None"]. ONLY use the following names: bar, horizontal_bar, line, pie, scatter, none
-'''),
-            ("human", '''
-User question: {question}
-SQL query: {sql_query}
-Query results: {results}
+        # Use the chart suggested alongside the SQL query, asking the LLM only when there is none
+        hint = self.sql_query_state.visualization_hint
+        if hint in VISUALIZATION_TYPES:
+            result = VisualizationTypeResponse(visualization=hint, visualization_reasoning="Suggested when generating the SQL query.")
+            return await self._apply_visualization_type(result)
 
-Recommend a visualization:'''),
-        ])
+        formatted_prompt = _VISUALIZATION_PROMPT.format_messages(question=question, sql_query=sql_query, results=preview_results(results))
+        result = await self._visualization_llm.ainvoke(formatted_prompt)
+        return await self._apply_visualization_type(result)
 
-        formatted_prompt = prompt.format(question=question, sql_query=sql_query, results=results)
-        response = self.llm_provider.with_structured_output(VisualizationTypeResponse)
-        result = response.invoke(formatted_prompt)
+    async def _apply_visualization_type(self, result: VisualizationTypeResponse) -> dict:
+        """Store the chosen visualization type and format the data for it."""
         self.sql_query_state.visualizationType = result
         if result.visualization == "none":
             return self.sql_query_state
         else:
-            self.sql_query_state.formatted_data_for_visualization = self.format_data_for_visualization()
+            # The data formatter is synchronous (it may label axes with the LLM), so keep it off the event loop
+            self.sql_query_state.formatted_data_for_visualization = await asyncio.to_thread(self.format_data_for_visualization)
             return self.sql_query_state
 
 
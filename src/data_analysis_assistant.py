@@ -1,120 +1,362 @@
-from numpy import False_
-from src.data_handler.sqlite_handler import SQLiteHandler
-from src.agents.query_preprocessor_agent import check_if_query_is_related_to_data, preprocess_query
+import asyncio
+import logging
+from functools import cached_property
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Optional, Sequence
+from src.data_handler.sqlite_handler import SQLiteHandler, get_schema_version
+from src.agents.query_preprocessor_agent import check_if_query_is_related_to_data, triage_and_preprocess, build_data_terms_re
 from src.agents.sql_agent import SQLAgent
+from src.agents.batch_formatter import BatchFormatter
 from src.agents.llm_provider import OpenAILLMProvider
-from src.vis.data_formatter import DataFormatter
-from src.vis.plotter import SimplePlotter
 from src.schemas.sql_agent_state import SQLQueryState
+from src.schemas.sql_query_model import QueryParseResponse, SQLPlanResponse
+from src.eval.batch_runner import BatchRunner
+from src.semantic_cache import SemanticCache
+
+logger = logging.getLogger(__name__)
 
 class DataAnalysisAssistant:
     """Agentic data analyst that converts natural language questions into analytics on tabular data."""
     
-    def __init__(self, project_uuid: str = None, upload_dir: str = "uploads", llm_provider: OpenAILLMProvider = None):
+    def __init__(self, project_uuid: str = None, upload_dir: str = "uploads", llm_provider: OpenAILLMProvider = None,
+                 batch_formatter: BatchFormatter = None):
         self.project_uuid = project_uuid
-        self.sqlite_handler = SQLiteHandler(upload_dir)
+        self.sqlite_handler = SQLiteHandler.get(upload_dir)
         self.llm_provider = llm_provider
         self.conversation_history = []
         self.sql_agent = None
+        self.data_terms_re = None
         self.preprocess_query = False
-        self.data_formatter = DataFormatter(llm_provider=self.llm_provider)
-        self.plotter = SimplePlotter()
+        # Answers to earlier queries, reused for near-duplicate questions about the same data
+        self.semantic_cache = SemanticCache(llm_provider.embeddings) if llm_provider else None
+        # Pending semantic cache updates, which run after the answer has been returned
+        self._cache_tasks = set()
+        # Concurrent queries share one LLM call for formatting their results; pass a shared formatter to batch across sessions
+        self.batch_formatter = batch_formatter or (BatchFormatter(llm_provider) if llm_provider else None)
+
+    @cached_property
+    def plotter(self):
+        """The plotter, created on first use; it only imports matplotlib when set to draw PNG charts."""
+        from src.vis.plotter import SimplePlotter
+        return SimplePlotter()
+
+    @cached_property
+    def _runner(self) -> asyncio.Runner:
+        """The event loop shared by the synchronous API, so its calls reuse the same connections."""
+        return asyncio.Runner()
+
+    def _run_sync(self, coro):
+        """Run a coroutine to completion from synchronous code.
+
+        Inside an already running event loop (e.g. Jupyter) the coroutine runs on its own loop in a worker thread.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self._runner.run(coro)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coro).result()
+
+    def close(self) -> None:
+        """Close the event loop used by the synchronous API."""
+        if "_runner" in self.__dict__:
+            self._runner.close()
+            del self._runner
 
-    def load_data(self, csv_file_paths: list[str], table_names: list[str] = None) -> str:
+    def load_data(self, csv_file_paths: Sequence[str], table_names: Sequence[str] = None) -> str:
         """Load multiple CSV files into a single SQLite database."""
         db_path = self.sqlite_handler.convert_multiple_files_to_sqlite(
             project_uuid=self.project_uuid,
             file_paths=csv_file_paths, 
             table_names=table_names
         )
-        print(f"Data loaded into database: {db_path}")
+        logger.info("Data loaded into database: %s", db_path)
         
         # Initialize SQL agent with the database
-        self.sql_agent = SQLAgent(db_path, sqlite_handler=self.sqlite_handler, llm_provider=self.llm_provider)
+        self.attach_database(db_path)
         return db_path
+
+    def attach_database(self, db_path: str) -> None:
+        """Initialize the SQL agent for an existing SQLite database."""
+        sql_agent = SQLAgent(db_path, sqlite_handler=self.sqlite_handler, llm_provider=self.llm_provider)
+        table_info = sql_agent.table_info
+        if not table_info:
+            raise RuntimeError(f"Database has no tables: {db_path}")
+        self.sql_agent = sql_agent
+        
+        # Table and column names let the relevance pre-filter accept domain queries without an LLM call
+        self.data_terms_re = build_data_terms_re(list(table_info) + [column for columns in table_info.values() for column in columns])
     
     def analyze_query(self, user_query: str, db_path: str) -> SQLQueryState:
         """Process a natural language query and return analysis results."""
-        
-        # Check if query is related to data analysis
-        query_check = check_if_query_is_related_to_data(user_query=user_query, llm_provider=self.llm_provider)
-        if query_check.ignore:
-            # Create a new SQLQueryState for ignored queries
-            ignored_state = SQLQueryState(
-                ignore=True,
-                reason_for_ignoring=query_check.reason,
-                suggestion_for_fixing="Please ask a question about the data, such as 'What are the average costs?' or 'Show me a chart of the distribution.'",
-                user_query=user_query,
-                output_response_to_user="I can only help with data analysis questions. Please ask about the data in your files."
-            )
+        return self._run_sync(self.analyze_query_async(user_query, db_path))
+
+    async def analyze_query_async(self, user_query: str, db_path: str) -> SQLQueryState:
+        """Process a natural language query without blocking the event loop."""
+        ignored_state, preprocessed_query = await self._triage_query(user_query)
+        if ignored_state is not None:
             return ignored_state
         
-        # Preprocess the query for clarity
-        if self.preprocess_query:
-            preprocessed_query = preprocess_query(user_query=user_query, llm_provider=self.llm_provider)
+        # Use SQL agent to parse the question and identify relevant tables
+        if self.sql_agent:
+            try:
+                schema_version = await asyncio.to_thread(get_schema_version, self.sql_agent.db_path)
+                cached_state = await self._cached_state(preprocessed_query, schema_version)
+                if cached_state is not None:
+                    return self._finish_query(user_query, preprocessed_query, cached_state)
+                
+                # Each query gets its own agent state so concurrent queries don't overwrite each other
+                sql_agent = self.sql_agent.fork()
+                await self._run_sql_pipeline(sql_agent, preprocessed_query)
+                state = self._finish_query(user_query, preprocessed_query, sql_agent.sql_query_state)
+                self._cache_state_in_background(preprocessed_query, schema_version, state)
+                return state
+            except Exception as e:
+                logger.exception("SQL agent failed for query %r", user_query)
+                return self._error_state(user_query, preprocessed_query)
         else:
-            preprocessed_query = user_query
+            return self._uninitialized_state(user_query, preprocessed_query)
+
+    async def analyze_query_stream(self, user_query: str, db_path: str) -> AsyncIterator[dict]:
+        """Process a query, yielding the response text as it is generated and then the final state.
+
+        A failure yields an "error" event with its message before the final state.
+        """
+        try:
+            ignored_state, preprocessed_query = await self._triage_query(user_query)
+        except Exception as e:
+            logger.exception("Query triage failed for query %r", user_query)
+            yield {"type": "error", "error": str(e)}
+            yield {"type": "result", "state": self._error_state(user_query, user_query).model_dump()}
+            return
+        if ignored_state is not None:
+            yield {"type": "result", "state": ignored_state.model_dump()}
+            return
         
+        if not self.sql_agent:
+            yield {"type": "result", "state": self._uninitialized_state(user_query, preprocessed_query).model_dump()}
+            return
         
-        # Use SQL agent to parse the question and identify relevant tables
-        if self.sql_agent:
+        try:
+            schema_version = await asyncio.to_thread(get_schema_version, self.sql_agent.db_path)
+            cached_state = await self._cached_state(preprocessed_query, schema_version)
+            if cached_state is not None:
+                yield {"type": "token", "content": cached_state.output_response_to_user}
+                state = self._finish_query(user_query, preprocessed_query, cached_state)
+                yield {"type": "result", "state": state.model_dump()}
+                return
+            
+            sql_agent = self.sql_agent.fork()
+            await self._run_sql_steps(sql_agent, preprocessed_query)
+            # step 6: choose the visualization type in the background while the answer streams
+            visualization_task = asyncio.create_task(sql_agent.choose_visualization_type())
+            try:
+                # step 5: stream the formatted results
+                async for chunk in sql_agent.astream_format_results():
+                    yield {"type": "token", "content": chunk}
+                await visualization_task
+            finally:
+                # Don't leave the visualization running if the client went away mid-stream
+                if not visualization_task.done():
+                    visualization_task.cancel()
+            state = self._finish_query(user_query, preprocessed_query, sql_agent.sql_query_state)
+            self._cache_state_in_background(preprocessed_query, schema_version, state)
+        except Exception as e:
+            logger.exception("SQL agent failed for query %r", user_query)
+            yield {"type": "error", "error": str(e)}
+            state = self._error_state(user_query, preprocessed_query)
+        yield {"type": "result", "state": state.model_dump()}
+
+    def analyze_query_batch(self, user_queries: Sequence[str], batch_runner: BatchRunner) -> list[SQLQueryState]:
+        """Answer a large, offline set of questions with one OpenAI Batch API job per LLM step.
+
+        Questions are not triaged, since offline question sets are about the data.
+        """
+        if not self.sql_agent:
+            return [self._uninitialized_state(query, query) for query in user_queries]
+
+        agents = {f"q{i}": self.sql_agent.fork() for i in range(len(user_queries))}
+        questions = dict(zip(agents, user_queries))
+        failed = set()
+
+        # step 1: parse every question in one batch
+        self._run_batch_step(batch_runner, agents, failed, "parse", lambda key, agent: agent.parse_question_prompt(questions[key]),
+                             QueryParseResponse, lambda agent, result: setattr(agent.sql_query_state, "query_parse_response", result))
+
+        with ThreadPoolExecutor() as executor:
+            # step 2: get the unique nouns for every question in parallel
+            self._run_local_step(executor, agents, failed, lambda agent: agent.get_unique_nouns())
+            # step 3: generate every SQL query in one batch
+            self._run_batch_step(batch_runner, agents, failed, "sql", lambda key, agent: agent.generate_sql_prompt(),
+                                 SQLPlanResponse, lambda agent, plan: agent.apply_sql_plan(plan))
+            # step 4: execute the queries in parallel
+            self._run_local_step(executor, agents, failed, lambda agent: agent.execute_query())
+
+        # step 5: format every result in one batch; questions without results already have their response set
+        formattable = {key: agent for key, agent in agents.items() if key not in failed and agent.format_results_prompt() is not None}
+        self._run_batch_step(batch_runner, formattable, failed, "format", lambda key, agent: agent.format_results_prompt(),
+                             None, lambda agent, response: setattr(agent.sql_query_state, "output_response_to_user", response))
+
+        # step 6: choose the visualizations, mostly from the hints given with the SQL queries
+        async def choose_visualizations():
+            await asyncio.gather(*(agent.choose_visualization_type() for key, agent in agents.items() if key not in failed))
+        self._run_sync(choose_visualizations())
+
+        states = []
+        for key, agent in agents.items():
+            if key in failed:
+                states.append(self._error_state(questions[key], questions[key]))
+            else:
+                states.append(self._finish_query(questions[key], questions[key], agent.sql_query_state))
+        return states
+
+    def _run_batch_step(self, batch_runner: BatchRunner, agents: dict, failed: set, step: str,
+                        build_prompt: Callable, response_schema, apply: Callable) -> None:
+        """Submit one prompt per remaining agent as a single batch and apply each response."""
+        pending = {key: agent for key, agent in agents.items() if key not in failed}
+        if not pending:
+            return
+        requests = [
+            batch_runner.build_request(f"{step}-{key}", build_prompt(key, agent), response_schema)
+            for key, agent in pending.items()
+        ]
+        results = batch_runner.run(requests)
+        for key, agent in pending.items():
+            content = results.get(f"{step}-{key}")
             try:
-                # step 1: parse the question
-                self.sql_agent.parse_question(question=preprocessed_query)
-                # step 2: get the unique nouns
-                self.sql_agent.get_unique_nouns()
-                # step 3: generate the SQL query
-                self.sql_agent.generate_sql()
-                # validate the SQL query
-                # step 4: execute the query
-                self.sql_agent.execute_query()
-                # step 5: format the results
-                self.sql_agent.format_results()
-                # step 6: choose the visualization type
-                self.sql_agent.choose_visualization_type()
-
-                # step 7: create and save plot if visualization data is available
-                self._create_plot_if_needed(user_query)
-
-                # Store in conversation history
-                self.conversation_history.append({
-                    "user_query": user_query,
-                    "preprocessed_query": preprocessed_query,
-                    "sql_query_state": self.sql_agent.sql_query_state.model_dump()
-                })
-
-                return self.sql_agent.sql_query_state
+                if content is None:
+                    raise ValueError("no response in the batch output")
+                apply(agent, response_schema.model_validate_json(content) if response_schema else content)
             except Exception as e:
-                # Create error state
-                error_state = SQLQueryState(
-                    ignore=True,
-                    reason_for_ignoring="Error in SQL agent",
-                    suggestion_for_fixing="Please try again later.",
-                    user_query=user_query,
-                    preprocessed_query=preprocessed_query,
-                    output_response_to_user="Sorry, there was an error processing your question. Please try again later."
-                )
-                return error_state
+                logger.warning("Batch step '%s' failed for %s: %s", step, key, e)
+                failed.add(key)
+
+    def _run_local_step(self, executor: ThreadPoolExecutor, agents: dict, failed: set, step: Callable) -> None:
+        """Run a database step for every remaining agent in parallel."""
+        pending = {key: agent for key, agent in agents.items() if key not in failed}
+        futures = {key: executor.submit(step, agent) for key, agent in pending.items()}
+        for key, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning("Database step failed for %s: %s", key, e)
+                failed.add(key)
+
+    async def _triage_query(self, user_query: str) -> tuple[Optional[SQLQueryState], str]:
+        """Check the query is about the data; return an ignored state or the query to analyze."""
+        
+        # Check if query is related to data analysis, preprocessing it in the same call when enabled
+        if self.preprocess_query:
+            query_check = await triage_and_preprocess(user_query=user_query, llm_provider=self.llm_provider, data_terms_re=self.data_terms_re)
+            suggestion = query_check.suggestion
         else:
-            # Create state for uninitialized SQL agent
-            uninitialized_state = SQLQueryState(
+            query_check = await check_if_query_is_related_to_data(user_query=user_query, llm_provider=self.llm_provider, data_terms_re=self.data_terms_re)
+            suggestion = ""
+        if query_check.ignore:
+            # Create a new SQLQueryState for ignored queries
+            ignored_state = SQLQueryState(
                 ignore=True,
-                reason_for_ignoring="SQL agent not initialized. Please load data first.",
-                suggestion_for_fixing="Please load data first.",
+                reason_for_ignoring=query_check.reason,
+                suggestion_for_fixing=suggestion or "Please ask a question about the data, such as 'What are the average costs?' or 'Show me a chart of the distribution.'",
                 user_query=user_query,
-                preprocessed_query=preprocessed_query,
-                output_response_to_user="Sorry, SQL agent not initialized. Please load data first."
+                output_response_to_user="I can only help with data analysis questions. Please ask about the data in your files."
             )
-            return uninitialized_state
+            return ignored_state, user_query
+        
+        if self.preprocess_query and query_check.preprocessed_query:
+            return None, query_check.preprocessed_query
+        return None, user_query
+
+    async def _cached_state(self, question: str, schema_version: int) -> Optional[SQLQueryState]:
+        """Return a copy of the state answering a near-identical earlier question, if any."""
+        if self.semantic_cache is None:
+            return None
+        try:
+            state = await self.semantic_cache.aget(self.sql_agent.db_path, schema_version, question)
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+            return None
+        if state is None:
+            return None
+        state = state.model_copy(deep=True)
+        state.user_query = question
+        return state
+
+    def _cache_state_in_background(self, question: str, schema_version: int, state: SQLQueryState) -> None:
+        """Remember the state of an answered question for near-duplicate questions, without delaying the answer."""
+        if self.semantic_cache is None or state.ignore:
+            return
+        task = asyncio.create_task(self._cache_state(self.sql_agent.db_path, question, schema_version, state.model_copy(deep=True)))
+        # Keep a reference so the task isn't garbage collected while running
+        self._cache_tasks.add(task)
+        task.add_done_callback(self._cache_tasks.discard)
+
+    async def _cache_state(self, db_path: str, question: str, schema_version: int, state: SQLQueryState) -> None:
+        """Store an answered question's state in the semantic cache; embedding the question calls the API."""
+        try:
+            await self.semantic_cache.aput(db_path, schema_version, question, state)
+        except Exception as e:
+            logger.warning("Semantic cache update failed: %s", e)
+
+    async def _run_sql_steps(self, sql_agent: SQLAgent, question: str) -> None:
+        """Run the SQL agent steps up to executing the query; database work runs in worker threads."""
+        # step 1: parse the question
+        await sql_agent.parse_question(question=question)
+        # step 2: get the unique nouns
+        await asyncio.to_thread(sql_agent.get_unique_nouns)
+        # step 3: generate the SQL query
+        await sql_agent.generate_sql()
+        # validate the SQL query
+        # step 4: execute the query in a worker thread
+        await asyncio.to_thread(sql_agent.execute_query)
+
+    async def _run_sql_pipeline(self, sql_agent: SQLAgent, question: str) -> None:
+        """Run the SQL agent steps for a single question."""
+        await self._run_sql_steps(sql_agent, question)
+        # steps 5 and 6 only depend on the query results, so format them and choose the visualization concurrently
+        await asyncio.gather(sql_agent.format_results(self.batch_formatter), sql_agent.choose_visualization_type())
+
+    def _finish_query(self, user_query: str, preprocessed_query: str, state: SQLQueryState) -> SQLQueryState:
+        """Plot the results and record the query in the conversation history."""
+        # step 7: create and save plot if visualization data is available
+        self._create_plot_if_needed(user_query, state)
+
+        # Store in conversation history
+        self.conversation_history.append({
+            "user_query": user_query,
+            "preprocessed_query": preprocessed_query,
+            "sql_query_state": state.model_dump()
+        })
+        return state
+
+    def _error_state(self, user_query: str, preprocessed_query: str) -> SQLQueryState:
+        """Create the state returned when the SQL agent fails."""
+        return SQLQueryState(
+            ignore=True,
+            reason_for_ignoring="Error in SQL agent",
+            suggestion_for_fixing="Please try again later.",
+            user_query=user_query,
+            preprocessed_query=preprocessed_query,
+            output_response_to_user="Sorry, there was an error processing your question. Please try again later."
+        )
+
+    def _uninitialized_state(self, user_query: str, preprocessed_query: str) -> SQLQueryState:
+        """Create the state returned when no data has been loaded yet."""
+        return SQLQueryState(
+            ignore=True,
+            reason_for_ignoring="SQL agent not initialized. Please load data first.",
+            suggestion_for_fixing="Please load data first.",
+            user_query=user_query,
+            preprocessed_query=preprocessed_query,
+            output_response_to_user="Sorry, SQL agent not initialized. Please load data first."
+        )
     
-    def _create_plot_if_needed(self, user_query: str):
+    def _create_plot_if_needed(self, user_query: str, state: SQLQueryState):
         """Create and save a plot if visualization data is available."""
         try:
-            if not self.sql_agent or not self.sql_agent.sql_query_state:
+            if not state:
                 return
             
-            state = self.sql_agent.sql_query_state
-            
             # Check if we have visualization data
             if (state.visualizationType and 
                 state.formatted_data_for_visualization and 
@@ -132,14 +374,14 @@ class DataAnalysisAssistant:
                 )
                 
                 if plot_path:
-                    print(f"Plot saved to: {plot_path}")
+                    logger.info("Plot saved to: %s", plot_path)
                     # Optionally, you could add the plot path to the state
                     # state.plot_path = plot_path
                 else:
-                    print("Failed to create plot")
+                    logger.warning("Failed to create plot")
                     
         except Exception as e:
-            print(f"Error creating plot: {e}")
+            logger.exception("Error creating plot: %s", e)
     
     def get_conversation_history(self) -> list:
         """Get the conversation history."""
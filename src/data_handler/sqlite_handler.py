@@ -1,28 +1,144 @@
+import csv
+import logging
 import pandas as pd
+import itertools
 import os
+import queue
+import re
 import sqlite3
+import threading
+import time
 import uuid
-from typing import List, Optional, Dict, Any
+import weakref
+from contextlib import closing
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Sequence
 from pathlib import Path
 
 from src.schemas.sql_query_model import QueryRequest, QueryResponse
 from src.data_handler.utils import table_exists
+from src.cache import LRUCache
+
+logger = logging.getLogger(__name__)
 
 UPLOAD_DIR = "uploads"
 
+# Characters not allowed in table names, replaced with underscores
+_INVALID_TABLE_NAME_CHARS = re.compile(r"[^0-9A-Za-z_]")
+
+# Rows parsed at a time from a CSV file, so large files are never fully in memory
+CSV_CHUNK_ROWS = 100_000
+
+# Rows fetched per batch when streaming a query's results
+FETCH_SIZE = 10_000
+
+# Parsed chunks buffered ahead of the SQLite writer while loading files
+PARSE_AHEAD_CHUNKS = 2
+
+# Bytes read from the start of a CSV file to detect its delimiter
+DELIMITER_SAMPLE_BYTES = 64 * 1024
+
+# Cells converted and inserted per executemany call while loading a file, so wide tables use fewer rows per chunk
+INSERT_CHUNK_CELLS = 1_000_000
+
+# Per-table schema strings keyed by (db_path, schema_version); SQLite bumps the version on every DDL change
+_schema_cache = LRUCache(maxsize=128)
+
+# Distinct values of every text column with their counts, built at load time for the unique-noun lookup
+NOUN_INDEX_TABLE = "_noun_index"
+
+# Prepared statements kept per pooled connection; SQLite re-prepares them itself after schema changes
+CACHED_STATEMENTS = 256
+
+# Load-side settings: fewer fsyncs and no on-disk rollback journal; a failed load is deleted and rebuilt from the source files
+INGEST_PRAGMAS = """
+PRAGMA journal_mode=MEMORY;
+PRAGMA synchronous=OFF;
+PRAGMA cache_size=-200000;
+PRAGMA temp_store=MEMORY;
+"""
+
+# Read-side settings for the pooled query connections
+QUERY_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA cache_size=-65536;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+"""
+
+# Run once a load is complete: collect planner statistics for the new tables, sampling large ones
+POST_LOAD_SQL = """
+PRAGMA analysis_limit=1000;
+ANALYZE;
+"""
+
+# Pooled query connections with the locks serializing their use, shared by the handlers and the schema helpers
+_connections = {}
+_connections_lock = threading.Lock()
+
+# How long a positive database existence check is trusted; project databases aren't deleted mid-session
+DB_EXISTS_TTL_SECONDS = 5.0
+
 
 class SQLiteHandler:
     """A class to handle SQLite database operations for CSV file conversion."""
     
+    # One live handler per upload directory, shared by every assistant using it
+    _instances = weakref.WeakValueDictionary()
+    
     def __init__(self, upload_dir: str = UPLOAD_DIR):
         """Initialize the SQLite handler with upload directory."""
         self.upload_dir = upload_dir
+        self._db_paths = {}
+        self._db_exists_until = {}
         self._ensure_upload_dir()
     
+    @classmethod
+    def get(cls, upload_dir: str = UPLOAD_DIR) -> "SQLiteHandler":
+        """Return the shared handler for an upload directory, creating it on first use."""
+        handler = cls._instances.get(upload_dir)
+        if handler is None:
+            handler = cls(upload_dir)
+            cls._instances[upload_dir] = handler
+        return handler
+    
+    def db_path_for(self, project_uuid: str) -> str:
+        """Return the database path for a project."""
+        db_path = self._db_paths.get(project_uuid)
+        if db_path is None:
+            db_path = os.path.join(self.upload_dir, f"{project_uuid}.sqlite")
+            self._db_paths[project_uuid] = db_path
+        return db_path
+    
+    def database_exists(self, project_uuid: str) -> bool:
+        """Check whether a project's database exists, trusting a positive answer for a few seconds."""
+        now = time.monotonic()
+        if self._db_exists_until.get(project_uuid, 0.0) > now:
+            return True
+        if os.path.exists(self.db_path_for(project_uuid)):
+            self._db_exists_until[project_uuid] = now + DB_EXISTS_TTL_SECONDS
+            return True
+        self._db_exists_until.pop(project_uuid, None)
+        return False
+    
     def _ensure_upload_dir(self) -> None:
         """Create upload directory if it doesn't exist."""
         os.makedirs(self.upload_dir, exist_ok=True)
     
+    def _connection(self, db_path: str) -> tuple[sqlite3.Connection, threading.Lock]:
+        """Return the pooled connection for a database and the lock serializing its use across threads."""
+        return _pooled_connection(db_path)
+    
+    def close_all(self) -> None:
+        """Close every pooled connection, e.g. on shutdown."""
+        close_all_connections()
+    
+    def _tuned_connect(self, db_path: str) -> sqlite3.Connection:
+        """Open a connection for bulk loading, in autocommit mode so the load controls its own transaction."""
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        conn.executescript(INGEST_PRAGMAS)
+        return conn
+    
     def _validate_file_format(self, file_path: str) -> str:
         """Validate file format and return the extension."""
         allowed_formats = ["csv", "xls", "xlsx"]
@@ -33,18 +149,27 @@ class SQLiteHandler:
         
         return file_extension
     
-    def _read_csv_file(self, file_path: str) -> pd.DataFrame:
-        """Read CSV file with appropriate parameters."""
+    def _read_csv_file(self, file_path: str) -> Iterator[pd.DataFrame]:
+        """Read CSV file with appropriate parameters, one chunk of rows at a time."""
         try:
-            # Try with semicolon delimiter first (as seen in the sample files)
-            df = pd.read_csv(file_path, delimiter=';', quoting=1, on_bad_lines='skip')
-            if len(df.columns) == 1:
-                # If only one column, try comma delimiter
-                df = pd.read_csv(file_path, delimiter=',', on_bad_lines='skip')
-            return df
+            # Detect the delimiter from a sample, so the file is parsed only once
+            # The file is memory-mapped so the C parser tokenizes straight from the page cache
+            reader = pd.read_csv(file_path, delimiter=self._detect_delimiter(file_path), on_bad_lines='skip',
+                                 engine='c', memory_map=True, chunksize=CSV_CHUNK_ROWS)
+            with reader:
+                yield from reader
         except Exception as e:
             raise RuntimeError(f"Error reading CSV file {file_path}: {str(e)}")
     
+    def _detect_delimiter(self, file_path: str) -> str:
+        """Guess a CSV file's delimiter from its first bytes, defaulting to a comma."""
+        try:
+            with open(file_path, newline="", errors="ignore") as f:
+                sample = f.read(DELIMITER_SAMPLE_BYTES)
+            return csv.Sniffer().sniff(sample, delimiters=";,|\t").delimiter
+        except (OSError, csv.Error):
+            return ","
+    
     def _read_excel_file(self, file_path: str) -> pd.DataFrame:
         """Read Excel file."""
         try:
@@ -52,75 +177,245 @@ class SQLiteHandler:
         except Exception as e:
             raise RuntimeError(f"Error reading Excel file {file_path}: {str(e)}")
     
-    def _read_file(self, file_path: str) -> pd.DataFrame:
-        """Read file based on its extension."""
+    def _read_file(self, file_path: str) -> Iterator[pd.DataFrame]:
+        """Read file based on its extension, as chunks of rows."""
         file_extension = self._validate_file_format(file_path)
         
         if file_extension == "csv":
             return self._read_csv_file(file_path)
         elif file_extension in ["xls", "xlsx"]:
-            return self._read_excel_file(file_path)
+            # Excel files can't be read incrementally, so they come as a single chunk
+            return iter([self._read_excel_file(file_path)])
         else:
             raise ValueError(f"Unsupported file format: {file_extension}")
     
     def _sanitize_table_name(self, name: str) -> str:
         """Sanitize table name to be SQLite compatible."""
         # Remove or replace invalid characters
-        sanitized = "".join(c if c.isalnum() or c == '_' else '_' for c in name)
+        sanitized = _INVALID_TABLE_NAME_CHARS.sub("_", name)
         # Ensure it starts with a letter or underscore
         if sanitized and not (sanitized[0].isalpha() or sanitized[0] == '_'):
             sanitized = f"table_{sanitized}"
         return sanitized or "unnamed_table"
     
-    def convert_multiple_files_to_sqlite(self, project_uuid: str, file_paths: List[str], 
+    def _create_table(self, conn: sqlite3.Connection, table_name: str, df: pd.DataFrame) -> None:
+        """Create a table with the DataFrame's columns, typed from their dtypes."""
+        conn.execute(f'DROP TABLE IF EXISTS {quote_identifier(table_name)}')
+        column_ddl = ",\n".join(f'{quote_identifier(str(column))} {self._sqlite_type(dtype)}' for column, dtype in df.dtypes.items())
+        conn.execute(f'CREATE TABLE {quote_identifier(table_name)} (\n{column_ddl}\n)')
+    
+    def _insert_dataframe(self, conn: sqlite3.Connection, table_name: str, df: pd.DataFrame) -> None:
+        """Bulk insert the DataFrame's rows into an existing table through one prepared statement."""
+        placeholders = ", ".join("?" * len(df.columns))
+        insert_sql = f'INSERT INTO {quote_identifier(table_name)} VALUES ({placeholders})'
+        chunk_rows = max(1, INSERT_CHUNK_CELLS // max(1, len(df.columns)))
+        for start in range(0, len(df), chunk_rows):
+            conn.executemany(insert_sql, self._dataframe_rows(df.iloc[start:start + chunk_rows]))
+    
+    def _sqlite_type(self, dtype) -> str:
+        """Map a pandas dtype to the SQLite column type to_sql would use."""
+        if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+            return "INTEGER"
+        if pd.api.types.is_float_dtype(dtype):
+            return "REAL"
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            return "TIMESTAMP"
+        return "TEXT"
+    
+    def _text_columns(self, df: pd.DataFrame) -> List[str]:
+        """Return the names of the DataFrame's text columns, stored as object or (pandas 3) str dtype."""
+        return [
+            str(column) for column, dtype in df.dtypes.items()
+            if pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+        ]
+    
+    def _build_noun_index(self, conn: sqlite3.Connection, text_columns: Dict[str, Iterable[str]]) -> None:
+        """Store the distinct values of the text columns, so noun lookups don't scan the data tables."""
+        conn.execute(f'DROP TABLE IF EXISTS "{NOUN_INDEX_TABLE}"')
+        conn.execute(
+            f'CREATE TABLE "{NOUN_INDEX_TABLE}" (table_name TEXT, column_name TEXT, value TEXT, frequency INTEGER, '
+            'PRIMARY KEY (table_name, column_name, value)) WITHOUT ROWID'
+        )
+        for table_name, columns in text_columns.items():
+            for column in columns:
+                conn.execute(
+                    f'INSERT INTO "{NOUN_INDEX_TABLE}" SELECT ?, ?, CAST({quote_identifier(column)} AS TEXT) AS v, COUNT(*) '
+                    f'FROM {quote_identifier(table_name)} WHERE v IS NOT NULL AND v != \'\' GROUP BY v',
+                    (table_name, column),
+                )
+    
+    def has_noun_index(self, db_path: str) -> bool:
+        """Check whether the database was loaded with a noun index."""
+        conn, lock = self._connection(db_path)
+        with lock:
+            row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (NOUN_INDEX_TABLE,)).fetchone()
+        return row is not None
+    
+    def _dataframe_rows(self, df: pd.DataFrame):
+        """Return row tuples of plain Python values, converting the DataFrame one column at a time."""
+        columns = []
+        for _, column in df.items():
+            if pd.api.types.is_datetime64_any_dtype(column):
+                # Store timestamps as text, the same way to_sql does
+                column = column.dt.strftime("%Y-%m-%d %H:%M:%S")
+            # tolist() converts a whole numpy column to Python scalars in C; NaN is stored as NULL by SQLite
+            columns.append(column.tolist())
+        return zip(*columns)
+    
+    def _read_files_ahead(self, file_paths: Sequence[str]) -> Iterator[tuple[int, int, pd.DataFrame]]:
+        """Yield (file index, chunk number, chunk) for every file in order, parsed ahead in a background thread."""
+        chunks = queue.Queue(maxsize=PARSE_AHEAD_CHUNKS)
+        stop = threading.Event()
+        
+        def put(item) -> bool:
+            # Give up once the consumer has stopped, rather than blocking on a full queue forever
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        def produce() -> None:
+            try:
+                for i, file_path in enumerate(file_paths):
+                    for chunk_number, df in enumerate(self._read_file(file_path)):
+                        if not put((i, chunk_number, df)):
+                            return
+                put(None)
+            except Exception as e:
+                put(e)
+        
+        producer = threading.Thread(target=produce, name="csv-parser", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = chunks.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+    
+    def convert_multiple_files_to_sqlite(self, project_uuid: str, file_paths: Sequence[str], 
                                        output_db_path: Optional[str] = None,
-                                       table_names: Optional[List[str]] = None) -> str:
+                                       table_names: Optional[Sequence[str]] = None) -> str:
         """Convert multiple files to a single SQLite database with separate tables."""
         if not file_paths:
             raise ValueError("No file paths provided")
         
         # Generate output database path if not provided
         if output_db_path is None:
-            print(f"Project already exists, using the existing database: {project_uuid}")
-            output_db_path = os.path.join(self.upload_dir, f"{project_uuid}.sqlite")
+            logger.debug("Using the default database path for project %s", project_uuid)
+            output_db_path = self.db_path_for(project_uuid)
         
         # Remove existing database if it exists
         if os.path.exists(output_db_path):
             return output_db_path
         
+        # A pooled connection may still point at a deleted earlier copy of this database
+        close_connection(output_db_path)
+        conn = self._tuned_connect(output_db_path)
         try:
-            with sqlite3.connect(output_db_path) as conn:
-                for i, file_path in enumerate(file_paths):
-                    # Read the file
-                    df = self._read_file(file_path)
-                    
+            # Load every file in a single transaction, so there is one commit at the end
+            conn.execute("BEGIN")
+            text_columns = {}
+            # Files are parsed in a background thread while the chunks parsed so far are inserted
+            with closing(self._read_files_ahead(file_paths)) as chunks:
+                for i, chunk_number, df in chunks:
                     # Generate table name
                     if table_names and i < len(table_names):
                         table_name = self._sanitize_table_name(table_names[i])
                     else:
-                        base_name = os.path.splitext(os.path.basename(file_path))[0]
+                        base_name = os.path.splitext(os.path.basename(file_paths[i]))[0]
                         table_name = self._sanitize_table_name(f"{base_name}_{i+1}")
                     
-                    # Convert to SQLite table
-                    df.to_sql(table_name, conn, if_exists="replace", index=False)
-                    print(f"Created table '{table_name}' from file '{file_path}'")
-            
-            return output_db_path
+                    # Load the file chunk by chunk into a SQLite table typed from its first chunk
+                    if chunk_number == 0:
+                        self._create_table(conn, table_name, df)
+                        text_columns[table_name] = {}
+                        logger.info("Created table '%s' from file '%s'", table_name, file_paths[i])
+                    # A column can hold text in any chunk (e.g. empty, hence numeric, in the first one), so index it if any does
+                    text_columns[table_name].update(dict.fromkeys(self._text_columns(df)))
+                    self._insert_dataframe(conn, table_name, df)
+            self._build_noun_index(conn, text_columns)
+            conn.execute("COMMIT")
             
         except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+            # Don't leave a half-built database behind, it would be reused as-is on the next load
+            if os.path.exists(output_db_path):
+                os.remove(output_db_path)
             raise RuntimeError(f"Error converting multiple files to SQLite: {str(e)}")
+        
+        # The data is committed by now; planner statistics are only an optimization, so a failure here is not fatal
+        try:
+            conn.executescript(POST_LOAD_SQL)
+        except sqlite3.Error as e:
+            logger.warning("Could not analyze database %s: %s", output_db_path, e)
+        finally:
+            conn.close()
+        
+        return output_db_path
     
-    def execute_query(self, db_path: str, query: str) -> List[List[Any]]:
-        """Execute a SQL query on the database and return results."""
+    def execute_query(self, db_path: str, query: str, params: Sequence[Any] = ()) -> List[tuple]:
+        """Execute a SQL query on the database and return results as row tuples."""
+        return self.execute_query_with_columns(db_path, query, params)[0]
+    
+    def execute_query_with_columns(self, db_path: str, query: str,
+                                   params: Sequence[Any] = ()) -> tuple[List[tuple], List[str]]:
+        """Execute a SQL query on the database and return its row tuples and result column names."""
         if not os.path.exists(db_path):
             raise FileNotFoundError(f"Database not found: {db_path}")
         
         try:
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                results = cursor.fetchall()
-                return [list(row) for row in results]
+            # Reuse one connection per database, so repeated queries skip the open and statement preparation
+            conn, lock = self._connection(db_path)
+            with lock:
+                cursor = conn.execute(query, params)
+                rows = cursor.fetchall()
+            columns = [description[0] for description in cursor.description or ()]
+            return rows, columns
+        except sqlite3.Error as e:
+            raise RuntimeError(f"SQL error: {e}")
+    
+    def execute_query_iter(self, db_path: str, query: str, params: Sequence[Any] = (),
+                           fetch_size: int = FETCH_SIZE) -> Iterator[List[tuple]]:
+        """Execute a SQL query and yield its row tuples in batches, for results too large to hold at once.
+
+        The query runs on its own connection, so a slow consumer doesn't hold up the pooled one.
+        """
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Database not found: {db_path}")
+        
+        try:
+            with closing(sqlite3.connect(db_path)) as conn:
+                cursor = conn.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    yield rows
+        except sqlite3.Error as e:
+            raise RuntimeError(f"SQL error: {e}")
+    
+    def execute_column_query(self, db_path: str, query: str, params: Sequence[Any] = ()) -> List[Any]:
+        """Execute a single-column SQL query and return its values as a flat list."""
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Database not found: {db_path}")
+        
+        try:
+            conn, lock = self._connection(db_path)
+            with lock:
+                results = conn.execute(query, params).fetchall()
+            # Flatten the 1-tuples in C rather than converting row by row
+            return list(itertools.chain.from_iterable(results))
         except sqlite3.Error as e:
             raise RuntimeError(f"SQL error: {e}")
     
@@ -130,21 +425,20 @@ class SQLiteHandler:
             raise FileNotFoundError(f"Database not found: {db_path}")
         
         try:
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Get all table names
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                tables = [row[0] for row in cursor.fetchall()]
-                
-                table_info = {}
-                for table in tables:
-                    # Get column information
-                    cursor.execute(f"PRAGMA table_info({table})")
-                    columns = [row[1] for row in cursor.fetchall()]
-                    table_info[table] = columns
-                
-                return table_info
+            conn, lock = self._connection(db_path)
+            with lock:
+                # Get every data table's columns in a single query
+                rows = conn.execute(
+                    "SELECT m.name, p.name FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+                    "WHERE m.type='table' AND m.name != ? AND m.name NOT LIKE 'sqlite\\_%' ESCAPE '\\' "
+                    "ORDER BY m.rowid, p.cid;",
+                    (NOUN_INDEX_TABLE,),
+                ).fetchall()
+            
+            table_info = {}
+            for table, column in rows:
+                table_info.setdefault(table, []).append(column)
+            return table_info
         except sqlite3.Error as e:
             raise RuntimeError(f"Error getting table info: {e}")
     
@@ -155,37 +449,114 @@ class SQLiteHandler:
         pass
 
 
-def get_schema(db_path: str) -> str:
-    """Get the schema of the database with sample data."""
+def quote_identifier(name: str) -> str:
+    """Quote a table or column name for use in SQL, escaping any embedded double quotes."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _pooled_connection(db_path: str) -> tuple[sqlite3.Connection, threading.Lock]:
+    """Return the pooled connection for a database, opening it with the query settings on first use."""
+    with _connections_lock:
+        pooled = _connections.get(db_path)
+        if pooled is None:
+            # Open read-write without create, so a missing database raises instead of being created empty
+            conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=rw", uri=True,
+                                   check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+            conn.executescript(QUERY_PRAGMAS)
+            pooled = (conn, threading.Lock())
+            _connections[db_path] = pooled
+        return pooled
+
+
+def close_connection(db_path: str) -> None:
+    """Close and forget the pooled connection for a database, if there is one."""
+    with _connections_lock:
+        pooled = _connections.pop(db_path, None)
+    if pooled is not None:
+        conn, lock = pooled
+        with lock:
+            conn.close()
+
+
+def close_all_connections() -> None:
+    """Close and forget every pooled connection."""
+    with _connections_lock:
+        pooled = list(_connections.values())
+        _connections.clear()
+    for conn, lock in pooled:
+        with lock:
+            conn.close()
+
+
+def get_schema_version(db_path: str) -> int:
+    """Return the database's schema version, which SQLite increments on every DDL change."""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database not found: {db_path}")
+
+    try:
+        conn, lock = _pooled_connection(db_path)
+        with lock:
+            return conn.execute("SELECT schema_version FROM pragma_schema_version;").fetchone()[0]
+    except sqlite3.Error as e:
+        raise RuntimeError(f"Error getting schema version: {e}")
+
+
+def get_schema(db_path: str, tables: Optional[Sequence[str]] = None) -> str:
+    """Get the schema of the database with sample data, optionally limited to the given tables."""
+    return join_schema_blocks(get_schema_blocks(db_path), tables)
+
+
+def join_schema_blocks(blocks: Dict[str, str], tables: Optional[Sequence[str]] = None) -> str:
+    """Join per-table schema blocks, keeping only the given tables when any of them exist."""
+    if tables:
+        selected = [blocks[table] for table in tables if table in blocks]
+        if selected:
+            return "\n".join(selected)
+    return "\n".join(blocks.values())
+
+
+def get_schema_blocks(db_path: str) -> Dict[str, str]:
+    """Get each table's schema with sample data, keyed by table name."""
     
     # Check if the database file exists
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"Database not found: {db_path}")
 
     try:
-        with sqlite3.connect(db_path) as conn:
+        conn, lock = _pooled_connection(db_path)
+        with lock:
             cursor = conn.cursor()
 
-            # Get the table schema from sqlite_master
-            cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
+            # Reuse the schema built for this version of the database
+            cursor.execute("SELECT schema_version FROM pragma_schema_version;")
+            cache_key = (db_path, cursor.fetchone()[0])
+            cached_blocks = _schema_cache.get(cache_key)
+            if cached_blocks is not None:
+                return cached_blocks
+
+            # Get every table's CREATE statement and columns in a single query
+            cursor.execute(
+                "SELECT m.name, m.sql, p.name FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+                "WHERE m.type='table' AND m.name != ? AND m.name NOT LIKE 'sqlite\\_%' ESCAPE '\\' "
+                "ORDER BY m.rowid, p.cid;",
+                (NOUN_INDEX_TABLE,),
+            )
+            tables = {}
+            for table_name, create_statement, column_name in cursor.fetchall():
+                tables.setdefault(table_name, (create_statement, []))[1].append(column_name)
 
-            schema_parts = []
+            blocks = {}
 
-            # Process each table and fetch its schema and example rows
-            for table_name, create_statement in tables:
+            # Process each table and fetch its example rows
+            for table_name, (create_statement, column_names) in tables.items():
+                schema_parts = []
                 schema_parts.append(f"Table: {table_name}")
                 schema_parts.append(f"CREATE statement: {create_statement}")
-                
-                # Get column information
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                columns_info = cursor.fetchall()
-                column_names = [col[1] for col in columns_info]
                 schema_parts.append(f"Columns: {', '.join(column_names)}")
                 schema_parts.append("")
 
                 # Fetch sample rows from the table
-                cursor.execute(f"SELECT * FROM '{table_name}' LIMIT 5;")
+                cursor.execute(f"SELECT * FROM {quote_identifier(table_name)} LIMIT 5;")
                 rows = cursor.fetchall()
                 if rows:
                     schema_parts.append("Sample data:")
@@ -194,8 +565,10 @@ def get_schema(db_path: str) -> str:
                     for i, row in enumerate(rows, 1):
                         schema_parts.append(f"Row {i}: {', '.join(str(cell) for cell in row)}")
                 schema_parts.append("")  # Blank line between tables
+                blocks[table_name] = "\n".join(schema_parts)
 
-            return "\n".join(schema_parts)
+            _schema_cache.put(cache_key, blocks)
+            return blocks
             
     except sqlite3.Error as e:
-        raise RuntimeError(f"Error getting database schema: {e}")
\ No newline at end of file
+        raise RuntimeError(f"Error getting database schema: {e}")
@@ -2,16 +2,10 @@
 
 def table_exists(conn, table_name_prefix):
     cursor = conn.cursor()
-    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
+    # Let SQLite find the first matching table instead of fetching every table into Python
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND instr(name, ?) > 0 LIMIT 1;", (table_name_prefix,))
 
-    has_cleaned_table = False
-    for table in tables:
-        table_name, create_statement = table
-        if table_name_prefix in table_name:
-            has_cleaned_table = True
-
-    if has_cleaned_table is False:
+    if cursor.fetchone() is None:
         raise RuntimeError(f"Cleaned Table does not exist in the database")
     
-    return True
\ No newline at end of file
+    return True
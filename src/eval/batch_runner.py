@@ -0,0 +1,103 @@
+import io
+import json
+import logging
+import time
+from typing import Optional
+
+from langchain_core.messages import convert_to_openai_messages
+from openai import OpenAI
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+POLL_INTERVAL_SECONDS = 30
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Batch API prices in USD per million (input, output) tokens, half the synchronous price
+BATCH_PRICES_PER_MILLION_TOKENS = {
+    "gpt-4o": (1.25, 5.00),
+    "gpt-4o-mini": (0.075, 0.30),
+}
+
+
+class BatchRunner:
+    """Run many independent chat completions as a single OpenAI Batch API job."""
+
+    def __init__(self, api_key: str, model_name: str = "gpt-4o-mini", temperature: float = 0.0,
+                 poll_interval: float = POLL_INTERVAL_SECONDS):
+        """Initialize the runner with the model used for every request in the batch."""
+        self.client = OpenAI(api_key=api_key)
+        self.model_name = model_name
+        self.temperature = temperature
+        self.poll_interval = poll_interval
+        # Token usage and estimated cost of every batch run, by batch id
+        self.usage = {}
+
+    def build_request(self, custom_id: str, messages: list, response_schema: Optional[type[BaseModel]] = None) -> dict:
+        """Build one JSONL line of the batch input file."""
+        body = {
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "messages": convert_to_openai_messages(messages),
+        }
+        if response_schema is not None:
+            body["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": response_schema.__name__, "schema": response_schema.model_json_schema()},
+            }
+        return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+    def run(self, requests: list[dict]) -> dict[str, str]:
+        """Submit the requests, wait for the batch to finish and return the responses by custom_id."""
+        batch_id = self.submit(requests)
+        batch = self.wait(batch_id)
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch_id} finished with status '{batch.status}'")
+        return self._read_results(batch_id, batch.output_file_id)
+
+    def submit(self, requests: list[dict]) -> str:
+        """Upload the requests as a JSONL file and start a batch job for them."""
+        payload = "\n".join(json.dumps(request) for request in requests).encode("utf-8")
+        input_file = self.client.files.create(file=("batch_input.jsonl", io.BytesIO(payload)), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+        )
+        logger.info("Submitted batch %s with %d requests", batch.id, len(requests))
+        return batch.id
+
+    def wait(self, batch_id: str):
+        """Poll the batch until it reaches a terminal status."""
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in TERMINAL_STATUSES:
+                return batch
+            logger.info("Batch %s is %s, checking again in %ss", batch_id, batch.status, self.poll_interval)
+            time.sleep(self.poll_interval)
+
+    def _read_results(self, batch_id: str, output_file_id: str) -> dict[str, str]:
+        """Download the output file, map each custom_id to its message content and record the batch's usage."""
+        output = self.client.files.content(output_file_id).text
+        results = {}
+        prompt_tokens = completion_tokens = 0
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                logger.warning("Request %s failed: %s", record["custom_id"], record.get("error"))
+                continue
+            body = response["body"]
+            results[record["custom_id"]] = body["choices"][0]["message"]["content"]
+            prompt_tokens += body.get("usage", {}).get("prompt_tokens", 0)
+            completion_tokens += body.get("usage", {}).get("completion_tokens", 0)
+
+        input_price, output_price = BATCH_PRICES_PER_MILLION_TOKENS.get(self.model_name, (0.0, 0.0))
+        cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+        self.usage[batch_id] = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cost_usd": cost}
+        logger.info("Batch %s used %d prompt and %d completion tokens (~$%.4f)", batch_id, prompt_tokens, completion_tokens, cost)
+        return results
@@ -0,0 +1,27 @@
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+LOG_DIR = "logs"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def setup_logging(log_dir: str = LOG_DIR, level: int = logging.INFO) -> QueueListener:
+    """Route all logging through a queue so records are written to stderr and a daily log file off the event loop.
+
+    The returned listener has to be started, and stopped on shutdown to flush pending records.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    file_handler = TimedRotatingFileHandler(os.path.join(log_dir, "app.log"), when="midnight", backupCount=7)
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    return QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from src.schemas.sql_query_model import QueryParseResponse, VisualizationTypeResponse
 
 class SQLQueryState(BaseModel):
@@ -8,9 +8,11 @@ class SQLQueryState(BaseModel):
     user_query: str = ""
     preprocessed_query: str = ""
     query_parse_response: QueryParseResponse = None
-    unique_nouns: list = []
+    unique_nouns: list = Field(default_factory=list)
     generated_sql_query: str = ""
-    results: list = []
+    visualization_hint: str = ""
+    results: list = Field(default_factory=list)
+    result_columns: list[str] = Field(default_factory=list)
     visualizationType: VisualizationTypeResponse = None
     formatted_data_for_visualization: dict = None
     output_response_to_user: str = None
@@ -1,7 +1,9 @@
-from pydantic import BaseModel
-from typing import Any
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Optional, Sequence
 
 class QueryRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     file_uuid: str
     query: str
 
@@ -9,19 +11,46 @@ class QueryCheckResponse(BaseModel):
     ignore: bool
     reason: str
 
+class QueryTriageResponse(BaseModel):
+    ignore: bool
+    reason: str
+    suggestion: str
+    preprocessed_query: Optional[str]
+
+# JSON schemas for the hot-path structured outputs, derived once at import
+QUERY_CHECK_SCHEMA = QueryCheckResponse.model_json_schema()
+QUERY_TRIAGE_SCHEMA = QueryTriageResponse.model_json_schema()
+
 class QueryResponse(BaseModel):
-    results: list[list[Any]]
+    model_config = ConfigDict(frozen=True)
+
+    results: list[Sequence[Any]]
 
 
+# Parse results are cached and shared across queries, so they are immutable
 class RelevantTable(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     table_name: str
     columns: list[str]
     noun_columns: list[str]
 
 class QueryParseResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     is_relevant: bool
     relevant_tables: list[RelevantTable]
 
 class VisualizationTypeResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     visualization: str
-    visualization_reasoning: str
\ No newline at end of file
+    visualization_reasoning: str
+
+class FormattedAnswersResponse(BaseModel):
+    answers: list[str]
+
+class SQLPlanResponse(BaseModel):
+    sql_query: Optional[str]
+    not_enough_info_reason: Optional[str]
+    visualization_hint: str
\ No newline at end of file
@@ -0,0 +1,55 @@
+from typing import Any, Hashable, Optional
+
+import numpy as np
+
+from src.cache import LRUCache
+
+
+class SemanticCache:
+    """Caches values by the meaning of a text, returning a hit for near-duplicate texts.
+
+    Entries are grouped per scope (e.g. a database) and dropped when the scope's version changes.
+    """
+
+    def __init__(self, embeddings, threshold: float = 0.95, maxsize: int = 256):
+        """Initialize the cache with a LangChain embeddings model and the cosine similarity needed for a hit."""
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._scopes = {}
+        self._embedding_cache = LRUCache(maxsize=maxsize)
+
+    async def _embed(self, text: str) -> np.ndarray:
+        """Return the normalized embedding of a text, embedding each text only once."""
+        vector = self._embedding_cache.get(text)
+        if vector is None:
+            vector = np.asarray(await self.embeddings.aembed_query(text), dtype=np.float32)
+            vector /= np.linalg.norm(vector)
+            self._embedding_cache.put(text, vector)
+        return vector
+
+    def _entries(self, scope: Hashable, version: Hashable) -> tuple[list, list]:
+        """Return the vectors and values stored for a scope, clearing them if the version changed."""
+        stored_version, vectors, values = self._scopes.get(scope, (None, [], []))
+        if stored_version != version:
+            vectors, values = [], []
+            self._scopes[scope] = (version, vectors, values)
+        return vectors, values
+
+    async def aget(self, scope: Hashable, version: Hashable, text: str) -> Optional[Any]:
+        """Return the value cached for the most similar text, or None if nothing is similar enough."""
+        vectors, values = self._entries(scope, version)
+        if not vectors:
+            return None
+        similarities = np.stack(vectors) @ await self._embed(text)
+        best = int(np.argmax(similarities))
+        return values[best] if similarities[best] >= self.threshold else None
+
+    async def aput(self, scope: Hashable, version: Hashable, text: str, value: Any) -> None:
+        """Cache a value for a text, evicting the oldest entry of the scope if it is full."""
+        vector = await self._embed(text)
+        vectors, values = self._entries(scope, version)
+        vectors.append(vector)
+        values.append(value)
+        if len(vectors) > self.maxsize:
+            del vectors[0], values[0]
@@ -1,9 +1,12 @@
 import json
+import logging
 from langchain_core.prompts import ChatPromptTemplate
 from src.agents.llm_provider import OpenAILLMProvider
 from src.vis.graph_instructions import graph_instructions
 from src.schemas.sql_query_model import VisualizationTypeResponse
 
+logger = logging.getLogger(__name__)
+
 class DataFormatter:
     def __init__(self, llm_provider: OpenAILLMProvider):
         self.llm_provider = llm_provider
@@ -91,7 +94,7 @@ class DataFormatter:
                 if label not in data_by_label:
                     data_by_label[label] = []
                 data_by_label[label].append(float(y))
-                print(labels)
+                logger.debug("Pie/line labels: %s", labels)
                 for other_label in labels:
                     if other_label != label:
                         if other_label not in data_by_label:
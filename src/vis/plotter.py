@@ -1,18 +1,115 @@
-import matplotlib.pyplot as plt
-import matplotlib
+import json
+import logging
 import os
+import threading
+from functools import cache
 from typing import Dict, Any, Optional
 from pathlib import Path
 
-# Use non-interactive backend for server environments
-matplotlib.use('Agg')
+logger = logging.getLogger(__name__)
+
+VEGA_LITE_SCHEMA = "https://vega.github.io/schema/vega-lite/v5.json"
+
+# Vega-Lite mark per chart type
+VEGA_MARKS = {'bar': 'bar', 'horizontal_bar': 'bar', 'line': 'line', 'pie': 'arc', 'scatter': 'point'}
+
+
+@cache
+def _pyplot():
+    """Import pyplot on first use, so the default Vega-Lite output never loads matplotlib."""
+    import matplotlib
+    # Use non-interactive backend for server environments
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _extract_series(data) -> Optional[tuple]:
+    """Return the chart's (labels, values, series label), or None if either labels or values are missing."""
+    # Handle nested data structure
+    if 'formatted_data_for_visualization' in data:
+        data = data['formatted_data_for_visualization']
+    
+    if isinstance(data, list):
+        # Direct list format: [{"label": "...", "value": ...}, ...]
+        # One pass over the items, then unzip; items missing a key still get the defaults
+        pairs = [(item.get('label', ''), item.get('value', 0)) for item in data]
+        labels = [label for label, _ in pairs]
+        values = [value for _, value in pairs]
+        series_label = 'Data'
+    else:
+        # Standard format: {"labels": [...], "values": [{"label": "...", "data": [...]}]}, plotting the first series
+        labels = data.get('labels', [])
+        values_data = data.get('values', [])
+        values = values_data[0].get('data', []) if values_data else []
+        series_label = values_data[0].get('label', 'Data') if values_data else 'Data'
+    
+    if not labels or not values:
+        return None
+    return labels, values, series_label
+
+
+def _needs_rotation(labels) -> bool:
+    """Check whether any x-axis label is longer than 10 characters."""
+    return max(map(len, map(str, labels)), default=0) > 10
+
+
+def _chart_title(query: str) -> str:
+    """Title a chart with the query, shortened to 50 characters."""
+    return f'Analysis: {query[:50]}{"..." if len(query) > 50 else ""}'
+
+
+def render_vega(kind: str, data: Dict[str, Any], query: str) -> Optional[dict]:
+    """Build a Vega-Lite spec for the chart, for the frontend to render, or return None if there is no data."""
+    series = _extract_series(data)
+    if series is None:
+        logger.warning("No data available for %s chart", kind)
+        return None
+    labels, values, series_label = series
+    
+    spec = {
+        '$schema': VEGA_LITE_SCHEMA,
+        'title': _chart_title(query),
+        'data': {'values': [{'label': label, 'value': value} for label, value in zip(labels, values)]},
+        'mark': {'type': VEGA_MARKS[kind], 'tooltip': True},
+    }
+    if kind == 'pie':
+        spec['encoding'] = {
+            'theta': {'field': 'value', 'type': 'quantitative'},
+            'color': {'field': 'label', 'type': 'nominal'},
+        }
+    elif kind == 'horizontal_bar':
+        # Categories on the y axis, bars extending along x
+        spec['encoding'] = {
+            'x': {'field': 'value', 'type': 'quantitative', 'title': series_label},
+            'y': {'field': 'label', 'type': 'nominal', 'title': 'Categories', 'sort': None},
+        }
+    else:
+        numeric_labels = all(isinstance(label, (int, float)) for label in labels)
+        x_type = 'quantitative' if kind == 'scatter' and numeric_labels else 'ordinal' if kind == 'line' else 'nominal'
+        spec['encoding'] = {
+            'x': {'field': 'label', 'type': x_type, 'title': 'Categories', 'sort': None},
+            'y': {'field': 'value', 'type': 'quantitative', 'title': series_label},
+        }
+    return spec
+
 
 class SimplePlotter:
     """Simple and modular plotting system for SQL agent visualizations."""
     
-    def __init__(self, output_dir: str = "output"):
-        """Initialize the plotter with output directory."""
+    def __init__(self, output_dir: str = "output", use_matplotlib: bool = False):
+        """Initialize the plotter with output directory.
+
+        By default charts are saved as Vega-Lite specs for the frontend to render; use_matplotlib saves PNGs instead.
+        """
         self.output_dir = output_dir
+        self.use_matplotlib = use_matplotlib
+        self._project_dirs = {}
+        # Files per project directory, counted once and then tracked in memory to number new plots
+        self._plot_counts = {}
+        # One figure per chart type, cleared and redrawn for each plot; matplotlib isn't thread-safe, hence the lock
+        self._figures = {}
+        self._lock = threading.RLock()
         self._ensure_output_dir()
     
     def _ensure_output_dir(self):
@@ -21,225 +118,217 @@ class SimplePlotter:
     
     def _get_project_dir(self, project_uuid: str) -> str:
         """Get or create project-specific directory."""
-        project_dir = os.path.join(self.output_dir, project_uuid)
-        os.makedirs(project_dir, exist_ok=True)
+        project_dir = self._project_dirs.get(project_uuid)
+        if project_dir is None:
+            project_dir = os.path.join(self.output_dir, project_uuid)
+            os.makedirs(project_dir, exist_ok=True)
+            self._project_dirs[project_uuid] = project_dir
         return project_dir
     
+    def _next_plot_index(self, project_uuid: str) -> int:
+        """Return the number for the project's next plot file, scanning its directory only the first time."""
+        count = self._plot_counts.get(project_uuid)
+        if count is None:
+            with os.scandir(self._get_project_dir(project_uuid)) as entries:
+                count = sum(1 for _ in entries)
+        self._plot_counts[project_uuid] = count + 1
+        return count
+    
     def _save_plot(self, project_uuid: str, filename: str, fig) -> str:
         """Save plot to project directory and return the file path."""
         project_dir = self._get_project_dir(project_uuid)
         filepath = os.path.join(project_dir, filename)
         fig.savefig(filepath, dpi=300, bbox_inches='tight')
-        plt.close(fig)  # Close figure to free memory
         return filepath
     
+    def _figure(self, kind: str, figsize: tuple) -> tuple:
+        """Return the reusable figure and axes for a chart type, cleared for a new plot."""
+        figure = self._figures.get(kind)
+        if figure is None:
+            figure = _pyplot().subplots(figsize=figsize)
+            self._figures[kind] = figure
+        fig, ax = figure
+        ax.clear()
+        return fig, ax
+    
+    def close(self) -> None:
+        """Close the reused figures."""
+        with self._lock:
+            for fig, _ in self._figures.values():
+                _pyplot().close(fig)
+            self._figures.clear()
+    
     def create_bar_chart(self, data: Dict[str, Any], project_uuid: str, query: str) -> Optional[str]:
         """Create and save a bar chart."""
         try:
-            # Handle nested data structure
-            if 'formatted_data_for_visualization' in data:
-                data = data['formatted_data_for_visualization']
-            
-            labels = data.get('labels', [])
-            values_data = data.get('values', [])
-            
-            if not labels or not values_data:
-                print("No data available for bar chart")
-                return None
-            
-            # Extract values from the first series
-            values = values_data[0].get('data', []) if values_data else []
-            series_label = values_data[0].get('label', 'Data') if values_data else 'Data'
-            
-            if not values:
-                print("No values available for bar chart")
+            series = _extract_series(data)
+            if series is None:
+                logger.warning("No data available for bar chart")
                 return None
+            labels, values, series_label = series
             
-            # Create the plot
-            fig, ax = plt.subplots(figsize=(10, 6))
-            bars = ax.bar(labels, values, color='skyblue', edgecolor='navy', alpha=0.7)
+            with self._lock:
+                # Create the plot
+                fig, ax = self._figure('bar', figsize=(10, 6))
+                bars = ax.bar(labels, values, color='skyblue', edgecolor='navy', alpha=0.7)
             
-            # Customize the plot
-            ax.set_title(f'Analysis: {query[:50]}{"..." if len(query) > 50 else ""}', 
-                        fontsize=14, fontweight='bold', pad=20)
-            ax.set_xlabel('Categories', fontsize=12)
-            ax.set_ylabel(series_label, fontsize=12)
+                # Customize the plot
+                ax.set_title(_chart_title(query), fontsize=14, fontweight='bold', pad=20)
+                ax.set_xlabel('Categories', fontsize=12)
+                ax.set_ylabel(series_label, fontsize=12)
             
-            # Add value labels on bars
-            for bar, value in zip(bars, values):
-                height = bar.get_height()
-                ax.text(bar.get_x() + bar.get_width()/2., height + 0.01,
-                       f'{value}', ha='center', va='bottom', fontweight='bold')
+                # Add value labels on bars
+                for bar, value in zip(bars, values):
+                    height = bar.get_height()
+                    ax.text(bar.get_x() + bar.get_width()/2., height + 0.01,
+                           f'{value}', ha='center', va='bottom', fontweight='bold')
             
-            # Rotate x-axis labels if they're long
-            if any(len(label) > 10 for label in labels):
-                plt.xticks(rotation=45, ha='right')
+                # Rotate x-axis labels if they're long
+                if _needs_rotation(labels):
+                    _pyplot().setp(ax.get_xticklabels(), rotation=45, ha='right')
             
-            plt.tight_layout()
+                fig.tight_layout()
             
-            # Save the plot
-            filename = f"bar_chart_{len(os.listdir(self._get_project_dir(project_uuid)))}.png"
-            return self._save_plot(project_uuid, filename, fig)
+                # Save the plot
+                filename = f"bar_chart_{self._next_plot_index(project_uuid)}.png"
+                return self._save_plot(project_uuid, filename, fig)
             
         except Exception as e:
-            print(f"Error creating bar chart: {e}")
+            logger.error("Error creating bar chart: %s", e)
             return None
     
     def create_line_chart(self, data: Dict[str, Any], project_uuid: str, query: str) -> Optional[str]:
         """Create and save a line chart."""
         try:
-            # Handle nested data structure
-            if 'formatted_data_for_visualization' in data:
-                data = data['formatted_data_for_visualization']
-            
-            labels = data.get('labels', [])
-            values_data = data.get('values', [])
-            
-            if not labels or not values_data:
-                print("No data available for line chart")
-                return None
-            
-            # Extract values from the first series
-            values = values_data[0].get('data', []) if values_data else []
-            series_label = values_data[0].get('label', 'Data') if values_data else 'Data'
-            
-            if not values:
-                print("No values available for line chart")
+            series = _extract_series(data)
+            if series is None:
+                logger.warning("No data available for line chart")
                 return None
+            labels, values, series_label = series
             
-            # Create the plot
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.plot(labels, values, marker='o', linewidth=2, markersize=6, color='blue')
+            with self._lock:
+                # Create the plot
+                fig, ax = self._figure('line', figsize=(10, 6))
+                ax.plot(labels, values, marker='o', linewidth=2, markersize=6, color='blue')
             
-            # Customize the plot
-            ax.set_title(f'Analysis: {query[:50]}{"..." if len(query) > 50 else ""}', 
-                        fontsize=14, fontweight='bold', pad=20)
-            ax.set_xlabel('Categories', fontsize=12)
-            ax.set_ylabel(series_label, fontsize=12)
-            ax.grid(True, alpha=0.3)
+                # Customize the plot
+                ax.set_title(_chart_title(query), fontsize=14, fontweight='bold', pad=20)
+                ax.set_xlabel('Categories', fontsize=12)
+                ax.set_ylabel(series_label, fontsize=12)
+                ax.grid(True, alpha=0.3)
             
-            # Rotate x-axis labels if they're long
-            if any(len(str(label)) > 10 for label in labels):
-                plt.xticks(rotation=45, ha='right')
+                # Rotate x-axis labels if they're long
+                if _needs_rotation(labels):
+                    _pyplot().setp(ax.get_xticklabels(), rotation=45, ha='right')
             
-            plt.tight_layout()
+                fig.tight_layout()
             
-            # Save the plot
-            filename = f"line_chart_{len(os.listdir(self._get_project_dir(project_uuid)))}.png"
-            return self._save_plot(project_uuid, filename, fig)
+                # Save the plot
+                filename = f"line_chart_{self._next_plot_index(project_uuid)}.png"
+                return self._save_plot(project_uuid, filename, fig)
             
         except Exception as e:
-            print(f"Error creating line chart: {e}")
+            logger.error("Error creating line chart: %s", e)
             return None
     
     def create_pie_chart(self, data: Dict[str, Any], project_uuid: str, query: str) -> Optional[str]:
         """Create and save a pie chart."""
         try:
-            # Handle nested data structure
-            if 'formatted_data_for_visualization' in data:
-                data = data['formatted_data_for_visualization']
-            
-            # Handle different data structures for pie charts
-            if isinstance(data, list):
-                # Direct list format: [{"label": "...", "value": ...}, ...]
-                labels = [item.get('label', '') for item in data]
-                values = [item.get('value', 0) for item in data]
-            else:
-                # Standard format: {"labels": [...], "values": [{"data": [...]}]}
-                labels = data.get('labels', [])
-                values_data = data.get('values', [])
-                
-                if not labels or not values_data:
-                    print("No data available for pie chart")
-                    return None
-                
-                # Extract values from the first series
-                values = values_data[0].get('data', []) if values_data else []
-            
-            if not labels or not values:
-                print("No data available for pie chart")
+            series = _extract_series(data)
+            if series is None:
+                logger.warning("No data available for pie chart")
                 return None
+            labels, values, _ = series
             
-            # Create the plot
-            fig, ax = plt.subplots(figsize=(10, 8))
-            colors = plt.cm.Set3(range(len(labels)))
+            with self._lock:
+                # Create the plot
+                fig, ax = self._figure('pie', figsize=(10, 8))
+                colors = _pyplot().cm.Set3(range(len(labels)))
             
-            wedges, texts, autotexts = ax.pie(values, labels=labels, autopct='%1.1f%%', 
-                                             colors=colors, startangle=90)
+                wedges, texts, autotexts = ax.pie(values, labels=labels, autopct='%1.1f%%', 
+                                                 colors=colors, startangle=90)
             
-            # Customize the plot
-            ax.set_title(f'Analysis: {query[:50]}{"..." if len(query) > 50 else ""}', 
-                        fontsize=14, fontweight='bold', pad=20)
+                # Customize the plot
+                ax.set_title(_chart_title(query), fontsize=14, fontweight='bold', pad=20)
             
-            # Make percentage text bold
-            for autotext in autotexts:
-                autotext.set_fontweight('bold')
-                autotext.set_fontsize(10)
+                # Make percentage text bold
+                for autotext in autotexts:
+                    autotext.set_fontweight('bold')
+                    autotext.set_fontsize(10)
             
-            plt.tight_layout()
+                fig.tight_layout()
             
-            # Save the plot
-            filename = f"pie_chart_{len(os.listdir(self._get_project_dir(project_uuid)))}.png"
-            return self._save_plot(project_uuid, filename, fig)
+                # Save the plot
+                filename = f"pie_chart_{self._next_plot_index(project_uuid)}.png"
+                return self._save_plot(project_uuid, filename, fig)
             
         except Exception as e:
-            print(f"Error creating pie chart: {e}")
+            logger.error("Error creating pie chart: %s", e)
             return None
     
     def create_scatter_plot(self, data: Dict[str, Any], project_uuid: str, query: str) -> Optional[str]:
         """Create and save a scatter plot."""
         try:
-            # Handle nested data structure
-            if 'formatted_data_for_visualization' in data:
-                data = data['formatted_data_for_visualization']
-            
-            labels = data.get('labels', [])
-            values_data = data.get('values', [])
-            
-            if not labels or not values_data:
-                print("No data available for scatter plot")
+            series = _extract_series(data)
+            if series is None:
+                logger.warning("No data available for scatter plot")
                 return None
+            labels, values, series_label = series
             
-            # Extract values from the first series
-            values = values_data[0].get('data', []) if values_data else []
-            series_label = values_data[0].get('label', 'Data') if values_data else 'Data'
+            with self._lock:
+                # Create the plot
+                fig, ax = self._figure('scatter', figsize=(10, 6))
+                ax.scatter(labels, values, s=100, alpha=0.7, color='red', edgecolors='black')
             
-            if not values:
-                print("No values available for scatter plot")
-                return None
+                # Customize the plot
+                ax.set_title(_chart_title(query), fontsize=14, fontweight='bold', pad=20)
+                ax.set_xlabel('Categories', fontsize=12)
+                ax.set_ylabel(series_label, fontsize=12)
+                ax.grid(True, alpha=0.3)
             
-            # Create the plot
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.scatter(labels, values, s=100, alpha=0.7, color='red', edgecolors='black')
+                # Rotate x-axis labels if they're long
+                if _needs_rotation(labels):
+                    _pyplot().setp(ax.get_xticklabels(), rotation=45, ha='right')
             
-            # Customize the plot
-            ax.set_title(f'Analysis: {query[:50]}{"..." if len(query) > 50 else ""}', 
-                        fontsize=14, fontweight='bold', pad=20)
-            ax.set_xlabel('Categories', fontsize=12)
-            ax.set_ylabel(series_label, fontsize=12)
-            ax.grid(True, alpha=0.3)
+                fig.tight_layout()
             
-            # Rotate x-axis labels if they're long
-            if any(len(str(label)) > 10 for label in labels):
-                plt.xticks(rotation=45, ha='right')
+                # Save the plot
+                filename = f"scatter_plot_{self._next_plot_index(project_uuid)}.png"
+                return self._save_plot(project_uuid, filename, fig)
             
-            plt.tight_layout()
+        except Exception as e:
+            logger.error("Error creating scatter plot: %s", e)
+            return None
+    
+    def create_vega_spec(self, kind: str, data: Dict[str, Any], project_uuid: str, query: str) -> Optional[str]:
+        """Create and save a Vega-Lite spec for the chart."""
+        try:
+            spec = render_vega(kind, data, query)
+            if spec is None:
+                return None
             
-            # Save the plot
-            filename = f"scatter_plot_{len(os.listdir(self._get_project_dir(project_uuid)))}.png"
-            return self._save_plot(project_uuid, filename, fig)
+            filename = f"{kind}_chart_{self._next_plot_index(project_uuid)}.vl.json"
+            filepath = os.path.join(self._get_project_dir(project_uuid), filename)
+            with open(filepath, 'w') as f:
+                json.dump(spec, f, default=str)
+            return filepath
             
         except Exception as e:
-            print(f"Error creating scatter plot: {e}")
+            logger.error("Error creating %s chart spec: %s", kind, e)
             return None
     
     def create_plot(self, visualization_type: str, data: Dict[str, Any], 
                    project_uuid: str, query: str) -> Optional[str]:
         """Create a plot based on the visualization type."""
         if not data or not project_uuid or not query:
-            print("Missing required parameters for plotting")
+            logger.warning("Missing required parameters for plotting")
             return None
         
+        kind = visualization_type.lower()
+        if not self.use_matplotlib and kind in VEGA_MARKS:
+            logger.info("Creating %s chart spec for project %s", visualization_type, project_uuid)
+            return self.create_vega_spec(kind, data, project_uuid, query)
+        
         # Map visualization types to methods
         plot_methods = {
             'bar': self.create_bar_chart,
@@ -248,10 +337,10 @@ class SimplePlotter:
             'scatter': self.create_scatter_plot
         }
         
-        plot_method = plot_methods.get(visualization_type.lower())
+        plot_method = plot_methods.get(kind)
         if not plot_method:
-            print(f"Unsupported visualization type: {visualization_type}")
+            logger.warning("Unsupported visualization type: %s", visualization_type)
             return None
         
-        print(f"Creating {visualization_type} chart for project {project_uuid}")
+        logger.info("Creating %s chart for project %s", visualization_type, project_uuid)
         return plot_method(data, project_uuid, query)
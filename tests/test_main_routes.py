@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+# The app builds its LLM provider at import time; no request below reaches the API
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import main_routes
+from src.cache import LRUCache
+from src.data_analysis_assistant import DataAnalysisAssistant
+from src.data_handler.sqlite_handler import close_all_connections
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A client for a fresh app working in a temporary directory, with the LLM stubbed out."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    with open("data/case_study_germany_sample.csv", "w") as f:
+        f.write("patient_id,city\n1,Berlin\n2,Munich\n")
+    with open("data/case_study_germany_treatment_costs_sample.csv", "w") as f:
+        f.write("patient_id,cost\n1,100.5\n2,200.0\n")
+
+    async def fake_stream(self, user_query, db_path):
+        yield {"type": "result", "state": {"db_path": db_path}}
+
+    monkeypatch.setattr(DataAnalysisAssistant, "analyze_query_stream", fake_stream)
+    monkeypatch.setattr(main_routes, "ASSISTANTS", LRUCache())
+    monkeypatch.setattr(main_routes, "KNOWN_SESSIONS", set())
+    yield TestClient(main_routes.create_app())
+    close_all_connections()
+
+
+def test_chat_reloads_deleted_database(client):
+    response = client.post("/create-user-session")
+    assert response.status_code == 200
+    session = response.json()
+    project_uuid = session["project_uuid"]
+    assert project_uuid in main_routes.KNOWN_SESSIONS
+
+    # Simulate a restart after the project's database was deleted
+    os.remove(session["db_path"])
+    main_routes.ASSISTANTS = LRUCache()
+
+    response = client.post("/chat-with-data", json={"project_uuid": project_uuid, "query": "How many patients are there?"})
+    assert response.status_code == 200
+    event = json.loads(response.text.removeprefix("data: "))
+    assert event["type"] == "result"
+    assert os.path.exists(session["db_path"])
+    assert project_uuid in main_routes.KNOWN_SESSIONS
+
+
+def test_history_of_unknown_project_is_404(client):
+    response = client.get("/get-conversation-history", params={"project_uuid": "no-such-project"})
+    assert response.status_code == 404
+    assert "no-such-project" not in main_routes.ASSISTANTS